@@ -1,10 +1,27 @@
+import time
+startup_begin=time.perf_counter()
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, ClientsideFunction
 import plotly.graph_objs as go
+import plotly.io as pio
 import pandas as pd
 import numpy as np
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+import cProfile
+import pstats
+from flask import request, g, has_request_context, Response
+from figure_cache import FigureCache, SqliteFigureStore
+from callback_metrics import CallbackMetrics, new_timings
+from elec_data import load_data, data_stamp, changed_countries, compact_tables
+from elec_metrics import compute_metrics, geo_table, series_years, tables_for_year, MetricsCube, base_labels, source_scores, ren
+from elec_tables import ElecTables
 
 
 #external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -48,19 +65,24 @@ server = app.server
 ####### DATA TABLES ##########
 ##############################
 
-master_elec=pd.read_csv("data/master_elec.csv")
-df_dep=pd.read_csv("data/elec_dep.csv")
-df_dom=pd.read_csv("data/dominant_source.csv")
-df_growth=pd.read_csv("data/df_growth.csv")
-df=pd.read_json("data/IntElecGen.json")
-
 metrics=[
       {'label': 'Dominant power source for electricity generation', 'value': 'dominant'},
       {'label': 'Total net electricity generation', 'value': "lastValue"},
       {'label': 'Electricity generation per capita', 'value': "kWh PP"},  
   ]
 
-ren=["Hydroelectricity", "Wind", "Biomass and waste", "Solar", "Geothermal", "Tide and wave"]
+#with METRICS_YEAR set, dependence, dominant source, per-capita generation
+#and growth are computed from the series for that year instead of being read
+#from the precomputed csv files (which are as of 2017). it is also the year
+#the page opens on; the other years are always computed from the series
+metrics_year=int(os.environ["METRICS_YEAR"]) if os.environ.get("METRICS_YEAR") else None
+display_year=metrics_year or 2017
+
+#with COMPACT_MEMORY set, the resident data is kept small: categorical
+#tables, float32 for the cube metrics that are only ranked or rounded, at
+#most a few year views at a time and compressed figures in the cache
+compact_memory=bool(os.environ.get("COMPACT_MEMORY"))
+max_year_views=4 if compact_memory else None
 
 metrics_max=[
       {'label': 'Fossil fuels', 'value': 'Fossil fuels'},
@@ -75,58 +97,283 @@ metrics_max=[
       {'label': 'All power sources', 'value': "Total Electricity net generation"}
 ]
 
+#hover name, unit and marker area scale of the two bubble map modes
+map_modes={
+  "lastValue": ("Total generation", "bln kWh", 0.5),
+  "kWh PP": ("Per capita generation", "thousand kWh PP", 20),
+}
+
+#decimals sent for each ranked metric; finer digits never reach the bars
+metric_decimals={"lastValue": 3, "kWh PP": 3, "dependence": 4}
+
 colors=pd.DataFrame({'value': ['Total Electricity net generation', 'Fossil fuels','Nuclear', 'Renewable','Hydroelectricity', 'Wind','Biomass and waste', 'Solar',  'Geothermal', 'Tide and wave'],
        "color": ['#636EFA','rgb(102,102,102)','#EF553B','#00CC96','#1F77B4', 'rgb(102, 197, 204)', 'rgb(248, 156, 116)', 'rgb(246, 207, 113)', 'rgb(220, 176, 242)', 'rgb(135, 197, 95)']
       })
+label_colors=dict(zip(colors["value"], colors["color"]))
+
+#RANKING INDEX
+#each (label, metric) ranking is sorted once at load, so a country's rank is
+#a dict lookup and the top n is a slice off the end of the sorted arrays.
+#a second copy without the aggregate rows serves the "excluding World" panels
+class RankIndex:
+  def __init__(self, country, value):
+    value=np.asarray(value, dtype=float)
+    keep=~np.isnan(value)
+    order=np.argsort(value[keep])
+    self.country=np.asarray(country)[keep][order]
+    self.value=value[keep][order]
+    keep=~np.isin(self.country, aggregates)
+    self.country_ex=self.country[keep]
+    self.value_ex=self.value[keep]
+    ranks=pd.Series(self.value).rank(method="max", ascending=False)
+    self.ranks=dict(zip(self.country[::-1], ranks.values[::-1]))
+
+  def rank(self, country):
+    #1-based, ties share the lowest position as in rank(method="max")
+    return self.ranks.get(country)
+
+  def top(self, n, exclude_aggregates=False):
+    #(countries, values) of the n largest, in ascending order
+    if exclude_aggregates:
+      return self.country_ex[-n:], self.value_ex[-n:]
+    return self.country[-n:], self.value[-n:]
+
+#rows that are not countries, left out of the "top n" bars where they would
+#otherwise always come first
+aggregates=["World"]
+
+#number of bars in the top n panels
+top_n=int(os.environ.get("TOP_N", 10))
+
+def build_rank_index(lookup):
+  rank_index={}
+  for m in metrics_max:
+    for metric in ["lastValue", "kWh PP", "dependence"]:
+      rank_index[(m["value"], metric)]=RankIndex(lookup.label_column(m["value"], metric, "country"), lookup.label_column(m["value"], metric))
+  return rank_index
+
+#COUNTRY SUMMARIES
+#everything the six summary statements need, gathered per country at load
+#instead of on every dropdown change
+def build_country_records(lookup):
+  records={}
+  for name in lookup.countries:
+    #labels with a value, in ascending order, ties in table order
+    by_value=lookup.ranked_labels(name, "lastValue", ren, dropna=True)
+    by_dep=lookup.ranked_labels(name, "dependence", ren, dropna=True)
+    records[name]={
+      "total": lookup.value(name, "Total Electricity net generation"),
+      "dominant": lookup.dominant(name),
+      "ren_dep": lookup.dependence(name, "Renewable"),
+      "ren_value": lookup.value(name, "Renewable"),
+      "top_ren_value": by_value[-1] if by_value else None,
+      "top_ren_dep": by_dep[-1] if by_dep else None,
+      "fastest_growing": lookup.ranked_labels(name, "growth", ren, dropna=True)[::-1][:2],
+    }
+  return records
+
+def country_summary(country, year=None):
+  year=year or display_year
+  d=app_data.view(year)
+  r=d.country_records.get(country)
+  if r is None:
+    return ["No data for {} in {}.".format(country, year), "", "", "", "", ""]
+
+  #statements about a missing value (a sentinel in the series) are left out
+  if pd.notna(r["total"]):
+    li1="{} billion kWh (net) electricity generated in {}.".format(f'{r["total"]:,}', year)
+  else:
+    li1="No total electricity generation reported for {} in {}.".format(country, year)
+
+  if r["dominant"]=='Nuclear':
+    li2="Nuclear power is the dominant power source for electricity generation."
+  elif r["dominant"]=='Fossil fuels':
+    li2= "Fossil fuels are the dominant power source for electricity generation."
+  elif r["dominant"]=='Renewable':
+    li2="Renewables are the dominant power source for electricity generation."
+  else:
+    #nothing generated from any of the three sources
+    li2=""
 
-cats=['Solar electricity net generation',
- 'Nuclear electricity net generation',
- 'Tide and wave electricity net generation',
- 'Renewable electricity net generation',
- 'Hydroelectricity net generation',
- 'Electricity net generation',
- 'Non-hydro renewable electricity net generation',
- 'Hydroelectric pumped storage electricity net generation',
- 'Solar, tide, wave, fuel cell electricity net generation',
- 'Wind electricity net generation',
- 'Geothermal electricity net generation',
- 'Fossil fuels electricity net generation',
- 'Biomass and waste electricity net generation']
-
-cat=[]
-label=[]
-country=[]
-
-for i in df["name"]:
-    if 'Solar, tide, wave, fuel cell electricity net generation' in i:
-        cat.append('Solar, tide, wave, fuel cell electricity net generation')
-    else:
-        for c in cats:
-            if c == i.split(",")[0]:
-                cat.append(c)
+  if pd.notna(r["ren_dep"]):
+    li3="Renewables constitute {}% of the power base used for electricity generation.".format(round(100*r["ren_dep"],1))
+  else:
+    li3=""
 
+  if r["ren_dep"]==0:
+    li21="Zero renewables in electricity generation mix as of {}.".format(year)
+  elif pd.notna(r["ren_value"]):
+    li21="{} billion kWh electricity generated from renewable sources.".format(f'{round(r["ren_value"],2):,}')
+  else:
+    li21=""
 
-for c in cat:
-    if c=="Electricity net generation":
-        label.append("Total Electricity net generation")
-    elif c=="Hydroelectricity net generation":
-        label.append("Hydroelectricity")
+  if country=="World":
+    li22="{} is the dominant renewable power source.".format(r["top_ren_value"]) if r["top_ren_value"] else ""
+    #needs two sources with a growth rate (a base year, with some generation)
+    if len(r["fastest_growing"])==2:
+      li23="{} is the fastest growing renewable power source, followed by {}.".format(*r["fastest_growing"])
     else:
-        label.append(c.split(" electricity net generation")[0])
-        
-
-for n in df["name"]:
-    if 'Solar, tide, wave, fuel cell electricity net generation' in n:
-        country.append(n.split(', ')[4])
+      li23=""
+  elif r["ren_dep"]==0:
+    li22=""
+    li23=""
+  else:
+    rank=d.rank_index[("Renewable", "lastValue")].rank(country)
+    li22="Ranked number {} globally for total quantity of renewable power generated.".format(int(rank-1)) if rank is not None else ""
+    li23="{} is the dominant renewable power source.".format(r["top_ren_dep"]) if r["top_ren_dep"] else ""
+
+  return [li1, li2, li3, li21, li22, li23]
+
+
+#WORLD MAP DATA
+#the join, rounding and hover text behind every map mode are computed once
+#here; the map builders only assemble figures from these arrays. the bubble
+#maps send the country names and rounded values, and a hovertemplate puts
+#the hover text together in the browser
+def build_map_data(lookup):
+  map_data={}
+
+  dom=lookup.dominant_rows()
+  dep=np.array([lookup.dependence(c, l) for c, l in zip(dom["country"], dom["dominant_source"])], dtype=float)
+  #countries whose dependence is zero or missing are left off the map
+  keep=np.nan_to_num(dep)!=0
+  map_data["dominant"]={
+    "locations": dom["iso"][keep],
+    "z": dom["score"][keep],
+    "text": dom["country"][keep]+"<br>"+dom["dominant_source"][keep]+" ("+np.round(100*dep[keep]).astype(int).astype(str).astype(object)+"%"+" dependent"+")",
+  }
+
+  label="Total Electricity net generation"
+  for value, (name, unit, mult) in map_modes.items():
+    v=lookup.label_column(label, value).astype(float)
+    map_data[value]={
+      "lon": lookup.label_column(label, value, "long"),
+      "lat": lookup.label_column(label, value, "lat"),
+      "text": lookup.label_column(label, value, "country"),
+      "value": np.round(v,2),
+      "size": np.clip(np.nan_to_num(np.round(mult*v,2), nan=0), 0, None),
+    }
+  return map_data
+
+#YEAR VIEWS
+#every year other than the one the page opens on is read off the metrics
+#cube: its tables are slices of the cube, and the rankings, summary records
+#and map arrays are gathered from them the first time the year is selected
+class YearView:
+  def __init__(self, cube, year):
+    self.lookup=ElecTables(cube.columns(year))
+    self.rank_index=build_rank_index(self.lookup)
+    self.country_records=build_country_records(self.lookup)
+    self.map_data=build_map_data(self.lookup)
+
+#MAP ANIMATION
+#the animated map has one fixed trace over every country in the cube; a
+#year's frame carries only what changes (choropleth z, or marker size) and
+#the numbers in the hover text, rounded, as arrays over the same countries
+def build_map_frames(cube, value):
+  keep=cube.geo["lat"].notna().values if value!="dominant" else cube.geo["iso"].notna().values
+  frames={"countries": cube.countries[keep], "years": [int(y) for y in cube.years]}
+  if value=="dominant":
+    frames["locations"]=cube.geo["iso"].values[keep]
+    code=cube.dominant[:, keep]
+    dep=np.stack([cube.arrays["dependence"][:, keep, cube.label_index[l]] if l in cube.label_index else np.zeros(code.shape) for l in base_labels], axis=2)
+    percent=np.round(100*np.take_along_axis(dep, code.clip(0)[:, :, None], axis=2)[:, :, 0])
+    shown=(code>=0)&(np.nan_to_num(percent)!=0)
+    frames["z"]=np.where(shown, np.array([source_scores[l] for l in base_labels])[code.clip(0)], np.nan)
+    frames["source"]=np.where(shown, np.array(base_labels, dtype=object)[code.clip(0)], None)
+    frames["percent"]=np.where(shown, np.where(shown, percent, 0).astype(int).astype(object), None)
+  else:
+    frames["lon"]=cube.geo["long"].values[keep]
+    frames["lat"]=cube.geo["lat"].values[keep]
+    if "Total Electricity net generation" in cube.label_index:
+      v=cube.arrays[value][:, keep, cube.label_index["Total Electricity net generation"]].astype(float)
     else:
-        country.append(n.split(", ")[1])
-
-df["country"]=country
-df["label"]=label
-
-countries = []
-for tic in master_elec["country"].drop_duplicates().sort_values():
-  countries.append({'label':tic, 'value':tic})
+      v=np.full((len(cube.years), keep.sum()), np.nan)
+    frames["size"]=np.round(np.clip(np.nan_to_num(map_modes[value][2]*v, nan=0), 0, None), 2)
+    frames["value"]=np.round(v, 2)
+  return frames
+
+#LOADED DATA
+#everything the callbacks read hangs off one object, so a refresh can build
+#its replacement alongside and swap a single reference
+class AppData:
+  def __init__(self, data):
+    self.data=data
+    self.version=data.version
+    self.tables=data.tables
+    if metrics_year:
+      self.tables=tables_for_year(compute_metrics(data.series, geo_table(data.tables)), metrics_year)
+      if compact_memory:
+        self.tables=compact_tables(self.tables)
+    self.lookup=ElecTables.from_frames(self.tables)
+    self.series=data.series
+    self.countries=[{'label':tic, 'value':tic} for tic in self.lookup.countries]
+    self.rank_index=build_rank_index(self.lookup)
+    self.country_records=build_country_records(self.lookup)
+    self.map_data=build_map_data(self.lookup)
+    self.years=sorted(set(series_years(data.series))|{display_year}, reverse=True)
+    self._cube=None
+    self._cube_lock=threading.Lock()
+    self._views=OrderedDict()
+    self._views_lock=threading.Lock()
+    self._map_frames={}
+    self.seal()
+
+  def seal(self):
+    #the numeric arrays are never written after load. marking them read-only
+    #keeps it that way, so the pages a forked worker shares with the master
+    #(see gunicorn_preload.py) are not copied by a stray in-place update
+    s=self.series
+    arrays=[s.offsets, s.dates, s.values]
+    if self._cube is not None:
+      arrays+=[self._cube.present, self._cube.dominant]+list(self._cube.arrays.values())
+    for r in self.rank_index.values():
+      arrays+=[r.value, r.value_ex]
+    for a in arrays:
+      a.setflags(write=False)
+
+  @property
+  def cube(self):
+    #the metrics of every year, built on the first request for another year
+    #than the opening one (or for the map animation), not at startup. under
+    #gunicorn_preload.py it is built in the master and shared
+    if self._cube is None:
+      with self._cube_lock:
+        if self._cube is None:
+          self._cube=MetricsCube(compute_metrics(self.data.series, geo_table(self.data.tables)), compact_memory)
+          self.seal()
+    return self._cube
+
+  def map_frames(self, value):
+    frames=self._map_frames.get(value)
+    if frames is None:
+      frames=self._map_frames[value]=build_map_frames(self.cube, value)
+    return frames
+
+  def view(self, year):
+    #rankings, summary records and map data of one year; the opening year is
+    #served from the tables above
+    if year is None or year==display_year:
+      return self
+    #the least recently used views are dropped past max_year_views. threads
+    #of one worker share the views; a view is built outside the lock, and the
+    #first one stored is kept
+    with self._views_lock:
+      view=self._views.get(year)
+      if view is not None:
+        self._views.move_to_end(year)
+        return view
+    view=YearView(self.cube, year)
+    with self._views_lock:
+      view=self._views.setdefault(year, view)
+      self._views.move_to_end(year)
+      if max_year_views and len(self._views)>max_year_views:
+        self._views.popitem(last=False)
+    return view
+
+#parsed, labelled and cleaned ahead of time by `python elec_data.py build`;
+#the source files are only read here when there is no current build
+app_data=AppData(load_data(compact_memory))
 
 
 ################################
@@ -143,6 +390,16 @@ titlecolor="#3d3d5c"
 ################################
 
 
+#SLIM TEMPLATE
+#every figure carries its template. plotly's default one is some 7 kB, mostly
+#defaults for trace types and subplots this app never draws; the figures here
+#use a copy of it with only the parts that apply to them
+pio.templates["elec"]=go.layout.Template(
+  layout={k: pio.templates["plotly"].layout[k] for k in
+    ["font", "hovermode", "hoverlabel", "paper_bgcolor", "plot_bgcolor", "colorway", "title", "xaxis", "yaxis", "geo"]},
+  data={"bar": pio.templates["plotly"].data.bar})
+pio.templates.default="elec"
+
 #WORLD & US MAPS
 l_map=go.Layout(
     height=400,
@@ -170,7 +427,7 @@ l_bar_w=go.Layout(
   plot_bgcolor=boxcolor,
   paper_bgcolor=boxcolor,
   yaxis={"tickfont":{"size":12},"gridwidth":2, "gridcolor":background},
-  xaxis={"tickfont":{"size":12}},
+  xaxis={"tickfont":{"size":12}, "type":"date"},
   legend={'orientation':'h','x':0.1, 'y':-0.2,'font':{'size':12}, 'itemclick': 'toggleothers'},
   dragmode=False
   )
@@ -198,16 +455,12 @@ conf = {'displayModeBar': False}
 ######## CHARTS ###############
 ###############################
 
-def make_fig_1a():
-  df=df_dom
-  df=df.merge(df_dep, how="left", left_on=["country", "dominant_source"], right_on=["country", "label"])
-  df["percent_dep"]=round(100*df["dependence"],0).astype("int")
-  df.drop(df[df["dependence"]==0].index.values, inplace=True)
-  df["text"]=df["country"]+"<br>"+df["dominant_source"]+ " ("+df["percent_dep"].astype("str")+"%"+" dependent"+")"
+def make_fig_1a(year=None):
+  m=app_data.view(year).map_data["dominant"]
   fig = go.Figure(data=go.Choropleth(
-      locations = df['iso'],
-      z = df['score'],
-      text = df['text'],
+      locations = m['locations'],
+      z = m['z'],
+      text = m['text'],
       hoverinfo= 'text',
       showscale = False,
       colorscale=[[0, colors["color"][3]], [0.5, colors["color"][2]], [1.0, colors["color"][1]]],
@@ -218,29 +471,17 @@ def make_fig_1a():
   fig.update_layout(l_map)
   return fig
 
-def make_fig_1(value):
-  table=master_elec
-  metric="Total Electricity net generation"
-  if value=="lastValue":
-    mult=0.5
-    name="Total generation"
-    unit="bln kWh"
-  else:
-    mult=20
-    name="Per capita generation"
-    unit="thousand kWh PP"
-
-
-  df=table[table["label"]==metric]
-  df["text"]= df["country"] +'<br>' + name + ": "+'<br>' + round(df[value],2).astype('str')+" "+unit
-
+def make_fig_1(value, year=None):
+  m=app_data.view(year).map_data[value]
+  name, unit, _=map_modes[value]
   d = go.Figure(go.Scattergeo(
-      lon=df["long"],
-      lat=df["lat"],
-      text = df['text'],
-      hoverinfo = 'text',
+      lon=m["lon"],
+      lat=m["lat"],
+      text = m['text'],
+      customdata = m['value'],
+      hovertemplate = "%{text}<br>"+name+": <br>%{customdata} "+unit+"<extra></extra>",
       marker=dict(
-          size= mult*df[value],
+          size= m["size"],
           line_width=0.5,
           sizemode='area',
           color="#636EFA"
@@ -252,393 +493,494 @@ def make_fig_1(value):
 
 
 
-def make_fig_3(d, label, metric, clip_pos):
-    if clip_pos==1:
-        fig = go.Figure(go.Bar(y=d[d["label"]==label].sort_values(by=metric, ascending=True)["country"][-11:-1],
-                              x=d[d["label"]==label].sort_values(by=metric,ascending=True)[metric][-11:-1],
-                             orientation='h',
-                             marker_color=colors["color"][colors["value"]==label].values[0]
-                            )
-                     )
-    else:
-        fig = go.Figure(go.Bar(y=d[d["label"]==label].sort_values(by=metric, ascending=True)["country"][-10:],
-                              x=d[d["label"]==label].sort_values(by=metric,ascending=True)[metric][-10:],
-                             orientation='h',
-                             marker_color=colors["color"][colors["value"]==label].values[0]
-                            )
-                     )
+def make_fig_1_animated(value):
+  #one frame per year, stepped through by the slider and play button
+  m=app_data.map_frames(value)
+  def values(i):
+    if value=="dominant":
+      return {"z": m["z"][i], "customdata": np.stack([m["source"][i], m["percent"][i]], axis=1)}
+    return {"marker": {"size": m["size"][i]}, "customdata": m["value"][i]}
+  if value=="dominant":
+    trace=go.Choropleth(
+      locations=m["locations"],
+      text=m["countries"],
+      hovertemplate="%{text}<br>%{customdata[0]} (%{customdata[1]}% dependent)<extra></extra>",
+      showscale=False,
+      zmin=-1,
+      zmax=1,
+      colorscale=[[0, colors["color"][3]], [0.5, colors["color"][2]], [1.0, colors["color"][1]]],
+      marker_line_width=0.5,
+      marker_line_color='white')
+    kind=go.Choropleth
+  else:
+    name, unit, _=map_modes[value]
+    trace=go.Scattergeo(
+      lon=m["lon"],
+      lat=m["lat"],
+      text=m["countries"],
+      hovertemplate="%{text}<br>"+name+": <br>%{customdata} "+unit+"<extra></extra>",
+      marker=dict(line_width=0.5, sizemode='area', color="#636EFA"))
+    kind=go.Scattergeo
+  trace.update(values(0))
+  fig=go.Figure(
+    data=[trace],
+    frames=[go.Frame(name=str(year), data=[kind(**values(i))], traces=[0]) for i, year in enumerate(m["years"])])
+  step={"mode": "immediate", "frame": {"duration": 300, "redraw": True}, "transition": {"duration": 0}}
+  fig.update_layout(l_map)
+  fig.update_layout(
+    height=480,
+    margin={"r":0,"t":0,"l":0,"b":70},
+    updatemenus=[{"type": "buttons", "showactive": False, "x": 0.05, "y": 0, "xanchor": "right", "yanchor": "top",
+      "buttons": [{"label": "Play", "method": "animate", "args": [None, dict(step, fromcurrent=True)]}]}],
+    sliders=[{"x": 0.05, "len": 0.95, "y": 0, "yanchor": "top", "currentvalue": {"prefix": "Year: "},
+      "steps": [{"label": str(year), "method": "animate", "args": [[str(year)], step]} for year in m["years"]]}])
+  fig.update_geos(projection_type="natural earth", lataxis_showgrid=False, lonaxis_showgrid=False, lataxis_range=[-60,85])
+  return fig
+
+def make_fig_3(label, metric, exclude_aggregates, n=top_n, year=None):
+    y, x=app_data.view(year).rank_index[(label, metric)].top(n, exclude_aggregates)
+    x=np.round(x, metric_decimals[metric])
+    fig = go.Figure(go.Bar(y=y,
+                          x=x,
+                         orientation='h',
+                         marker_color=label_colors[label]
+                        )
+                 )
     fig.update_layout(l_bar_s)
+    if n>10:
+      fig.update_layout(height=20*n)
     return fig
 
-def make_fig_2(geo):
-    k=df["data"][df["country"]==geo]
-
-    x=[]
-    y=[]
-    name="Fossil fuels"
-    for i in range(len(k[df["label"]==name].iloc[0])):
-        x.append(pd.to_datetime(k[df["label"]==name].iloc[0][i]["date"], unit="ms"))
-        y.append(k[df["label"]==name].iloc[0][i]["value"])
-        y=[0 if x =="(s)" else x for x in y]
-        y=[0 if x =="NA" else x for x in y]
-
-    x2=[]
-    y2=[]
-    name2="Nuclear"
-    for i in range(len(k[df["label"]==name2].iloc[0])):
-        x2.append(pd.to_datetime(k[df["label"]==name2].iloc[0][i]["date"], unit="ms"))
-        y2.append(k[df["label"]==name2].iloc[0][i]["value"])
-        y2=[0 if x =="(s)" else x for x in y2]
-        y2=[0 if x =="NA" else x for x in y2]
-
-    x3=[]
-    y3=[]
-    name3="Renewable"
-    for i in range(len(k[df["label"]==name3].iloc[0])):
-        x3.append(pd.to_datetime(k[df["label"]==name3].iloc[0][i]["date"], unit="ms"))
-        y3.append(k[df["label"]==name3].iloc[0][i]["value"])
-        y3=[0 if x =="(s)" else x for x in y3]
-        y3=[0 if x =="NA" else x for x in y3]
-
+def make_fig_trend(geo, names):
+    #stacked bars of one country's series, one trace per label; dates are
+    #sent as epoch milliseconds on a date axis and sentinels as zero
+    series=app_data.series
     fig = go.Figure()
-    fig.add_trace(go.Bar(
-      x=x[:-1], 
-      y=y[:-1],
-      hoverinfo='name+y',
-      name=name,
-      marker_color=colors["color"][colors["value"]==name].values[0]
-    ))
-    fig.add_trace(go.Bar(
-      x=x2[:-1], 
-      y=y2[:-1],
-      hoverinfo='name+y',
-      name=name2,
-      marker_color=colors["color"][colors["value"]==name2].values[0]
-    ))
-    fig.add_trace(go.Bar(
-      x=x3[:-1], 
-      y=y3[:-1],
-      hoverinfo='name+y',
-      name=name3,
-      marker_color=colors["color"][colors["value"]==name3].values[0]
-    ))
-
+    for name in names:
+        dates, values=series.get(geo, name)
+        fig.add_trace(go.Bar(
+          x=dates[:-1],
+          y=np.nan_to_num(values[:-1]),
+          hoverinfo='name+y',
+          name=name,
+          marker_color=label_colors[name]
+        ))
     fig.update_layout(barmode='stack')
     fig.update_layout(l_bar_w)
     return fig
 
+def make_fig_2(geo):
+    return make_fig_trend(geo, ["Fossil fuels", "Nuclear", "Renewable"])
 
-def make_fig_2b(geo):
-    k=df["data"][df["country"]==geo]
-
-    x=[]
-    y=[]
-    name="Hydroelectricity"
-    for i in range(len(k[df["label"]==name].iloc[0])):
-        x.append(pd.to_datetime(k[df["label"]==name].iloc[0][i]["date"], unit="ms"))
-        y.append(k[df["label"]==name].iloc[0][i]["value"])
-        y=[0 if x =="(s)" else x for x in y]
-        y=[0 if x =="NA" else x for x in y]
-
-    x2=[]
-    y2=[]
-    name2="Wind"
-    for i in range(len(k[df["label"]==name2].iloc[0])):
-        x2.append(pd.to_datetime(k[df["label"]==name2].iloc[0][i]["date"], unit="ms"))
-        y2.append(k[df["label"]==name2].iloc[0][i]["value"])
-        y2=[0 if x =="(s)" else x for x in y2]
-        y2=[0 if x =="NA" else x for x in y2]
-
-    x3=[]
-    y3=[]
-    name3="Biomass and waste"
-    for i in range(len(k[df["label"]==name3].iloc[0])):
-        x3.append(pd.to_datetime(k[df["label"]==name3].iloc[0][i]["date"], unit="ms"))
-        y3.append(k[df["label"]==name3].iloc[0][i]["value"])
-        y3=[0 if x =="(s)" else x for x in y3]
-        y3=[0 if x =="NA" else x for x in y3]
-    
-    x4=[]
-    y4=[]
-    name4="Solar"
-    for i in range(len(k[df["label"]==name4].iloc[0])):
-        x4.append(pd.to_datetime(k[df["label"]==name4].iloc[0][i]["date"], unit="ms"))
-        y4.append(k[df["label"]==name4].iloc[0][i]["value"])
-        y4=[0 if x =="(s)" else x for x in y4]
-        y4=[0 if x =="NA" else x for x in y4]
-    
-    x5=[]
-    y5=[]
-    name5="Geothermal"
-    for i in range(len(k[df["label"]==name5].iloc[0])):
-        x5.append(pd.to_datetime(k[df["label"]==name5].iloc[0][i]["date"], unit="ms"))
-        y5.append(k[df["label"]==name5].iloc[0][i]["value"])
-        y5=[0 if x =="(s)" else x for x in y5]
-        y5=[0 if x =="NA" else x for x in y5]
-    
-    x6=[]
-    y6=[]
-    name6="Tide and wave"
-    for i in range(len(k[df["label"]==name6].iloc[0])):
-        x6.append(pd.to_datetime(k[df["label"]==name6].iloc[0][i]["date"], unit="ms"))
-        y6.append(k[df["label"]==name6].iloc[0][i]["value"])
-        y6=[0 if x =="(s)" else x for x in y6]
-        y6=[0 if x =="NA" else x for x in y6]
-        
 
-    fig = go.Figure()
-    fig.add_trace(go.Bar(
-      x=x[:-1], 
-      y=y[:-1],
-      hoverinfo='name+y',
-      name=name,
-      marker_color=colors["color"][colors["value"]==name].values[0]
-    ))
-    fig.add_trace(go.Bar(
-      x=x2[:-1], 
-      y=y2[:-1],
-      hoverinfo='name+y',
-      name=name2,
-      marker_color=colors["color"][colors["value"]==name2].values[0]
-    ))
-    fig.add_trace(go.Bar(
-      x=x3[:-1], 
-      y=y3[:-1],
-      hoverinfo='name+y',
-      name=name3,
-      marker_color=colors["color"][colors["value"]==name3].values[0]
-    ))
-    
-    fig.add_trace(go.Bar(
-      x=x4[:-1], 
-      y=y4[:-1],
-      hoverinfo='name+y',
-      name=name4,
-      marker_color=colors["color"][colors["value"]==name4].values[0]
-    ))
-    
-    fig.add_trace(go.Bar(
-      x=x5[:-1], 
-      y=y5[:-1],
-      hoverinfo='name+y',
-      name=name5,
-      marker_color=colors["color"][colors["value"]==name5].values[0]
-    ))
-    
-    fig.add_trace(go.Bar(
-      x=x6[:-1], 
-      y=y6[:-1],
-      hoverinfo='name+y',
-      name=name6,
-      marker_color=colors["color"][colors["value"]==name6].values[0]
-    ))
-
-    fig.update_layout(barmode='stack'),
-    fig.update_layout(l_bar_w),
+def make_fig_2b(geo):
+    fig = make_fig_trend(geo, ren)
     fig.update_layout(legend={'orientation':'h','x':0.05, 'y':-0.2,'font':{'size':12}})
     return fig
 
+#the map and top n charts are keyed on (selection, year)
+def make_world_map(key):
+  selection, year=key
+  if selection=='dominant':
+    return make_fig_1a(year)
+  return make_fig_1(selection, year)
+
+def make_world_map_animated(selection):
+  return make_fig_1_animated(selection)
+
+def make_top_abs(key):
+  metric, year=key
+  fig= make_fig_3(metric, "lastValue", True, year=year)
+  fig.update_layout(xaxis_title= "billion kWh")
+  return fig
+
+def make_top_cap(key):
+  metric, year=key
+  fig= make_fig_3(metric, "kWh PP", False, year=year)
+  fig.update_layout(xaxis_title= "thousand kWh PP")
+  if not len(fig.data[0].y):
+    #per-capita figures need the population, known for one year only
+    fig.update_layout(xaxis_title="no per-capita figures for {}".format(year or display_year))
+  return fig
+
+def make_top_dep(key):
+  metric, year=key
+  fig= make_fig_3(metric, "dependence", False, year=year)
+  fig.update_layout(xaxis_title= "fraction of power base")
+  return fig
+
+def make_trend_all(country):
+  fig= make_fig_2(country)
+  fig.update_layout(yaxis_title= "billion kWh")
+  fig.update_layout(title="Total electricity generation: " + country)
+  return fig
+
+def make_trend_ren(country):
+  fig= make_fig_2b(country)
+  fig.update_layout(yaxis_title= "billion kWh")
+  fig.update_layout(title="Renewables in elec. generation: " +  country)
+  return fig
+
+
+###############################
+######## FIGURE CACHE #########
+###############################
+
+#FIGURE_CACHE_DB points every worker at one shared sqlite file; entries
+#written against other versions of the data files are ignored and purged
+figure_store=None
+if os.environ.get("FIGURE_CACHE_DB"):
+  figure_store=SqliteFigureStore(os.environ["FIGURE_CACHE_DB"], app_data.version)
+
+figure_cache=FigureCache(int(os.environ.get("FIGURE_CACHE_SIZE", 512)), figure_store, compact_memory)
+
+figure_builders={
+  "world_map": make_world_map,
+  "world_map_anim": make_world_map_animated,
+  "top_10_abs": make_top_abs,
+  "top_10_ren": make_top_cap,
+  "top_10_dep": make_top_dep,
+  "trend-all": make_trend_all,
+  "trend-ren": make_trend_ren,
+}
+
+def cached_figure(chart, key):
+  #entries are filed under the data version they were rendered from
+  timings=g.get("timings") if has_request_context() else None
+  return figure_cache.get((app_data.version, chart, key), lambda: figure_builders[chart](key), timings)
+
+def figure_keys(years=None):
+  #every (chart, key) pair the dropdowns can request in the given years,
+  #by default only the year the page opens on
+  years=years or [display_year]
+  keys=[("world_map", (m["value"], y)) for y in years for m in metrics]
+  keys+=[("world_map_anim", m["value"]) for m in metrics]
+  keys+=[(chart, (m["value"], y)) for y in years for chart in ["top_10_abs", "top_10_ren"] for m in metrics_max]
+  keys+=[("top_10_dep", (m["value"], y)) for y in years for m in metrics_max[:-1]]
+  keys+=[(chart, c["value"]) for chart in ["trend-all", "trend-ren"] for c in app_data.countries]
+  return keys
+
+#CLIENTSIDE VIEWS
+#with CLIENTSIDE_CALLBACKS set, switching the map mode or the label of a top
+#n panel is done in the browser (assets/clientside.js) from a store holding
+#every view of the selected year: the three map figures, and per top n panel
+#one figure plus the bars of each label. only a change of year, or turning
+#on the animation, goes back to the server
+clientside_callbacks=bool(os.environ.get("CLIENTSIDE_CALLBACKS"))
+
+#(ranked metric, excluding aggregates, labels offered) of each top n panel
+top_charts={
+  "top_10_abs": ("lastValue", True, metrics_max),
+  "top_10_ren": ("kWh PP", False, metrics_max),
+  "top_10_dep": ("dependence", False, metrics_max[:-1]),
+}
+
+def view_data(year):
+  d=app_data.view(year)
+  data={"maps": {m["value"]: cached_figure("world_map", (m["value"], year)) for m in metrics}, "bars": {}, "colors": label_colors}
+  for chart, (metric, exclude, labels) in top_charts.items():
+    bars={}
+    for m in labels:
+      y, x=d.rank_index[(m["value"], metric)].top(top_n, exclude)
+      bars[m["value"]]=[y.tolist(), np.round(x, metric_decimals[metric]).tolist()]
+    data["bars"][chart]={"figure": cached_figure(chart, (labels[0]["value"], year)), "labels": bars}
+  return data
+
+def warm_figure_cache():
+  for chart, key in figure_keys():
+    cached_figure(chart, key)
+
+
+###############################
+######## DATA REFRESH #########
+###############################
+
+#with DATA_REFRESH_INTERVAL (seconds) set, each worker checks that often
+#whether the data build or the source files changed. the new data is loaded
+#and everything derived from it rebuilt in full; it is diffed against the
+#current data only to keep the cached figures the changes do not touch. the
+#result is swapped in while requests keep being served from the old data
+refresh_interval=float(os.environ.get("DATA_REFRESH_INTERVAL", 0))
+refresh_lock=threading.Lock()
+last_refresh_check=time.monotonic()
+
+def refresh_data():
+  global app_data
+  with refresh_lock:
+    old=app_data
+    data=load_data(compact_memory)
+    if data.version==old.version:
+      old.data.stamp=data.stamp
+      return set()
+    changed=changed_countries(old.data, data)
+    new=AppData(data)
+    tables_changed=any(not old.tables[name].equals(new.tables[name]) for name in new.tables)
+
+    #the opening year is drawn from the tables, other years from the series
+    def is_stale(key):
+      chart, k=key
+      if chart in ("trend-all", "trend-ren"):
+        return k in changed
+      if chart=="world_map_anim":
+        return bool(changed)
+      if k[1]==display_year:
+        return tables_changed
+      return bool(changed)
+
+    figure_cache.carry_over(old.version, new.version, is_stale)
+    app_data=new
+    print("data refreshed to version {} ({} countries changed)".format(new.version, len(changed)), flush=True)
+    return changed
+
+@server.before_request
+def check_for_new_data():
+  global last_refresh_check
+  if not refresh_interval or time.monotonic()-last_refresh_check<refresh_interval:
+    return
+  last_refresh_check=time.monotonic()
+  if data_stamp()!=app_data.data.stamp and not refresh_lock.locked():
+    threading.Thread(target=refresh_data, daemon=True).start()
+
 
 
 ################################################
 #### APP LAYOUT  ###############################
 ################################################
 
-app.layout = html.Div([
-
-  html.Div([#header
-    html.Div([
-      html.H3("Global Electricity Generation Mix", style={"color": headercolor, "marginBottom": "0.2%"}),
-      html.P('Data source: U.S. Energy Information Administration',style={'font-size': '1rem','color':'#696969',"marginBottom": "0%"}),
-      ],
-    className='row',
-    style={'paddingTop':'0%', 'text-align':'center', "margin":"1%"}
-    ),
-  html.Div([#body
-    html.Div([#left six columns
-      html.Div([#left side top half
-        html.H5("Worldwide, as of 2017", style={"color": titlecolor, "marginBottom": "2%"}),
+#with LAZY_LAYOUT the graphs start empty and the initial callbacks fill them;
+#otherwise the default views come from the figure cache. either way nothing
+#is rendered at import
+lazy_layout=bool(os.environ.get("LAZY_LAYOUT"))
+
+def initial_figure(chart, key, lazy):
+  if lazy:
+    return {"data": [], "layout": {}}
+  return cached_figure(chart, key)
+
+def serve_layout(lazy=lazy_layout):
+  stores=[]
+  if clientside_callbacks:
+    stores=[
+      dcc.Store(id="view-data", data=None if lazy else view_data(display_year)),
+      dcc.Store(id="map-anim"),
+      ]
+  return html.Div(stores+[
+
+    html.Div([#header
+      html.Div([
+        html.H3("Global Electricity Generation Mix", style={"color": headercolor, "marginBottom": "0.2%"}),
+        html.P('Data source: U.S. Energy Information Administration',style={'font-size': '1rem','color':'#696969',"marginBottom": "0%"}),
         html.Div([
           dcc.Dropdown(
-            id='metric-select-ww',
-            options = metrics,
-            value = metrics[0]["value"],
+            id='year-select',
+            options = [{'label': str(y), 'value': y} for y in app_data.years],
+            value = display_year,
+            clearable = False,
             multi = False
-            )
+            ),
           ],
-          style={"marginBottom":"2%"}
+          style={'width':'120px', 'margin':'auto', 'marginTop':'0.5%', 'text-align':'left'}
           ),
-        dcc.Graph(
-          id="world_map",
-          figure=make_fig_1a(),
-          config=conf
-          )
         ],
-        style={'background-color':boxcolor,'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'2%'},
-        className='row'
-        ),
-      html.Div([#left side bottom half
-        html.Div([#left side bottom half four columns
-          html.H6(id="abs_title", children="Top 10: Total generation", style={"color": titlecolor}),
+      className='row',
+      style={'paddingTop':'0%', 'text-align':'center', "margin":"1%"}
+      ),
+    html.Div([#body
+      html.Div([#left six columns
+        html.Div([#left side top half
+          html.H5(id="ww_title", children="Worldwide, as of {}".format(display_year), style={"color": titlecolor, "marginBottom": "2%"}),
           html.Div([
             dcc.Dropdown(
-              id='metric-select-abs',
-              options = metrics_max,
-              value = metrics_max[0]["value"],
+              id='metric-select-ww',
+              options = metrics,
+              value = metrics[0]["value"],
               multi = False
               ),
+            dcc.Checklist(
+              id='map-animate',
+              options = [{'label': ' Animate through the years', 'value': 'animate'}],
+              value = [],
+              style = {'marginTop':'1%'}
+              )
             ],
-            style={'marginBottom':'4%','font-size': '1.2rem'}
+            style={"marginBottom":"2%"}
             ),
           dcc.Graph(
-            id="top_10_abs",
-            figure=make_fig_3(master_elec, metrics_max[0]["value"], "lastValue",1),
+            id="world_map",
+            figure=initial_figure("world_map", (metrics[0]["value"], display_year), lazy),
             config=conf
             )
           ],
           style={'background-color':boxcolor,'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'2%'},
-          className="four columns flex-display"
+          className='row'
           ),
-        html.Div([#left side bottom half four columns
-          html.H6(id="capita_title", children="Top 10: Per capita generation", style={"color": titlecolor}),
-          html.Div([
-            dcc.Dropdown(
-              id='metric-select-cap',
-              options = metrics_max,
-              value = metrics_max[0]["value"],
-              multi = False
+        html.Div([#left side bottom half
+          html.Div([#left side bottom half four columns
+            html.H6(id="abs_title", children="Top {}: Total generation".format(top_n), style={"color": titlecolor}),
+            html.Div([
+              dcc.Dropdown(
+                id='metric-select-abs',
+                options = metrics_max,
+                value = metrics_max[0]["value"],
+                multi = False
+                ),
+              ],
+              style={'marginBottom':'4%','font-size': '1.2rem'}
               ),
+            dcc.Graph(
+              id="top_10_abs",
+              figure=initial_figure("top_10_abs", (metrics_max[0]["value"], display_year), lazy),
+              config=conf
+              )
             ],
-            style={'marginBottom':'4%','font-size': '1.2rem'}
+            style={'background-color':boxcolor,'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'2%'},
+            className="four columns flex-display"
             ),
-          dcc.Graph(
-            id="top_10_ren",
-            figure=make_fig_3(master_elec, metrics_max[0]["value"], "kWh PP",0),
-            config=conf
+          html.Div([#left side bottom half four columns
+            html.H6(id="capita_title", children="Top {}: Per capita generation".format(top_n), style={"color": titlecolor}),
+            html.Div([
+              dcc.Dropdown(
+                id='metric-select-cap',
+                options = metrics_max,
+                value = metrics_max[0]["value"],
+                multi = False
+                ),
+              ],
+              style={'marginBottom':'4%','font-size': '1.2rem'}
+              ),
+            dcc.Graph(
+              id="top_10_ren",
+              figure=initial_figure("top_10_ren", (metrics_max[0]["value"], display_year), lazy),
+              config=conf
+              )
+            ],
+            style={'background-color':boxcolor,'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'2%'},
+            className="four columns flex-display"
+            ),
+          html.Div([#left side bottom half four columns
+            html.H6(id="dep_title", children= "Top {}: Relative dependence".format(top_n), style={"color": titlecolor}),
+            html.Div([
+              dcc.Dropdown(
+                id='metric-select-dep',
+                options = metrics_max[:-1],
+                value = metrics_max[0]["value"],
+                multi = False
+                ),
+              ],
+              style={'marginBottom':'4%','font-size': '1.2rem'}
+              ),
+            dcc.Graph(
+              id="top_10_dep",
+              figure=initial_figure("top_10_dep", (metrics_max[0]["value"], display_year), lazy),
+              config=conf
+              )
+            ],
+            style={'background-color':boxcolor,'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'2%'},
+            className="four columns flex-display"
             )
           ],
-          style={'background-color':boxcolor,'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'2%'},
-          className="four columns flex-display"
+          className='row'
           ),
-        html.Div([#left side bottom half four columns
-          html.H6(id="dep_title", children= "Top 10: Relative dependence", style={"color": titlecolor}),
+        ],
+        className='six columns flex-display'
+        ),
+      html.Div([#right six columns
+        html.Div([#headers
+          html.H5(id="country_title", children="By country, as of {}".format(display_year), style={"color": titlecolor, "marginBottom": "2%"}),
           html.Div([
             dcc.Dropdown(
-              id='metric-select-dep',
-              options = metrics_max[:-1],
-              value = metrics_max[0]["value"],
+              id='country-select',
+              options = app_data.countries,
+              value = "World",
               multi = False
               ),
             ],
-            style={'marginBottom':'4%','font-size': '1.2rem'}
-            ),
-          dcc.Graph(
-            id="top_10_dep",
-            figure=make_fig_3(df_dep, metrics_max[0]["value"], "dependence",0),
-            config=conf
-            )
-          ],
-          style={'background-color':boxcolor,'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'2%'},
-          className="four columns flex-display"
-          )
-        ],
-        className='row'
-        ),
-      ],
-      className='six columns flex-display'
-      ),
-    html.Div([#right six columns
-      html.Div([#headers
-        html.H5("By country, as of 2017", style={"color": titlecolor, "marginBottom": "2%"}),
-        html.Div([
-          dcc.Dropdown(
-            id='country-select',
-            options = countries,
-            value = "World",
-            multi = False
+            style={"marginBottom": "2%"}
             ),
           ],
-          style={"marginBottom": "2%"}
-          ),
-        ],
-        className="row"
-        ),
-      html.Div([#row for top chart
-        html.Div([
-          dcc.Graph(
-            id="trend-all",
-            figure=make_fig_2("World"),
-            config=conf
-            )
-          ],
-          className="eight columns flex-display"
+          className="row"
           ),
-        html.Div([
-          html.Ul([
-            html.Li(id="li1", style={"font-size": "1.5rem"}),
-            html.Li(id="li2", style={"font-size": "1.5rem"}),
-            html.Li(id="li3", style={"font-size": "1.5rem"})
-            ], 
-            style={"list-style-position": "outside", "marginLeft":"10%", "vertical-align":"middle"},
+        html.Div([#row for top chart
+          html.Div([
+            dcc.Graph(
+              id="trend-all",
+              figure=initial_figure("trend-all", "World", lazy),
+              config=conf
+              )
+            ],
+            className="eight columns flex-display"
             ),
-          ],
-          className='four columns flex-display',
-          style={"paddingLeft":"0%","paddingRight":"2%","marginTop":"5%"}
-          ),
-        ],
-        className='row flex-display',
-        #style={"display": "flex"}
-        ),
-      html.Div([
-        html.Hr()
-        ]),
-      html.Div([#right bottom row
-        html.Div([
-          dcc.Graph(
-            id="trend-ren",
-            figure=make_fig_2b("World"),
-            config=conf
-            )
-          ], 
-          className="eight columns flex-display",
-          style={"margin": "auto"}
-          ),
-        html.Div([
+          html.Div([
             html.Ul([
-              html.Li(id="li21", style={"font-size": "1.5rem"}),
-              html.Li(id="li22", style={"font-size": "1.5rem"}),
-              html.Li(id="li23", style={"font-size": "1.5rem"})
+              html.Li(id="li1", style={"font-size": "1.5rem"}),
+              html.Li(id="li2", style={"font-size": "1.5rem"}),
+              html.Li(id="li3", style={"font-size": "1.5rem"})
               ], 
               style={"list-style-position": "outside", "marginLeft":"10%", "vertical-align":"middle"},
               ),
             ],
             className='four columns flex-display',
-            style={"paddingLeft":"0%","paddingRight":"2%","marginTop": "5%"}
-            )
+            style={"paddingLeft":"0%","paddingRight":"2%","marginTop":"5%"}
+            ),
+          ],
+          className='row flex-display',
+          #style={"display": "flex"}
+          ),
+        html.Div([
+          html.Hr()
+          ]),
+        html.Div([#right bottom row
+          html.Div([
+            dcc.Graph(
+              id="trend-ren",
+              figure=initial_figure("trend-ren", "World", lazy),
+              config=conf
+              )
+            ], 
+            className="eight columns flex-display",
+            style={"margin": "auto"}
+            ),
+          html.Div([
+              html.Ul([
+                html.Li(id="li21", style={"font-size": "1.5rem"}),
+                html.Li(id="li22", style={"font-size": "1.5rem"}),
+                html.Li(id="li23", style={"font-size": "1.5rem"})
+                ], 
+                style={"list-style-position": "outside", "marginLeft":"10%", "vertical-align":"middle"},
+                ),
+              ],
+              className='four columns flex-display',
+              style={"paddingLeft":"0%","paddingRight":"2%","marginTop": "5%"}
+              )
+          ],
+          className='row flex-display',
+          #style={"display": "flex"}
+          ),
         ],
-        className='row flex-display',
-        #style={"display": "flex"}
-        ),
+        style={'background-color':boxcolor, 'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'1%'},
+        className='six columns flex-display'
+        )
       ],
-      style={'background-color':boxcolor, 'border-radius': '5px','box-shadow': '2px 2px 2px lightgrey','padding':'1%', 'marginBottom':'1%'},
-      className='six columns flex-display'
-      )
-    ],
-    style={'padding':'0', "marginBottom":"0"},
-    className="row"
-    ),
-  html.Div([#footer
-    html.A("Built by Anthony S N Maina", href='https://www.linkedin.com/in/anthonymaina/', target="_blank", style={'font-size': '1rem',"marginBottom": "0%"})
-    ],
-    className='row',
-    style={ 'text-align':'center'}
-    ),
-    ], 
-    style={'marginLeft':'1%','marginRight':'1%', "marginTop":"0", "paddingTop":"0"}),
-
-],
-style={'backgroundColor': background, 'margin':0}
-)
+      style={'padding':'0', "marginBottom":"0"},
+      className="row"
+      ),
+    html.Div([#footer
+      html.A("Built by Anthony S N Maina", href='https://www.linkedin.com/in/anthonymaina/', target="_blank", style={'font-size': '1rem',"marginBottom": "0%"})
+      ],
+      className='row',
+      style={ 'text-align':'center'}
+      ),
+      ], 
+      style={'marginLeft':'1%','marginRight':'1%', "marginTop":"0", "paddingTop":"0"}),
+
+  ],
+  style={'backgroundColor': background, 'margin':0}
+  )
+
+#dash validates callbacks against a full copy of a layout function's output;
+#an empty-figure copy keeps that from rendering anything at import
+app.validation_layout = serve_layout(lazy=True)
+app.layout = serve_layout
 
 
 ################################################
@@ -646,134 +988,251 @@ style={'backgroundColor': background, 'margin':0}
 ################################################
 
 @app.callback(
-  Output('world_map', 'figure'),
-  [Input('metric-select-ww', 'value')])
-def update_chart(selection):
-  if selection=='dominant':
-    df=df_dom
-    df=df.merge(df_dep, how="left", left_on=["country", "dominant_source"], right_on=["country", "label"])
-    df["percent_dep"]=round(100*df["dependence"],0).astype("int")
-    df.drop(df[df["dependence"]==0].index.values, inplace=True)
-    df["text"]=df["country"]+"<br>"+df["dominant_source"]+ " ("+df["percent_dep"].astype("str")+"%"+" dependent"+")"
-    fig = go.Figure(data=go.Choropleth(
-        locations = df['iso'],
-        z = df['score'],
-        text = df['text'],
-        hoverinfo= 'text',
-        showscale = False,
-        colorscale=[[0, colors["color"][3]], [0.5, colors["color"][2]], [1.0, colors["color"][1]]],
-        marker_line_width=0.5,
-        marker_line_color='white',
-    ))
-    fig.update_layout({"geo": {"projection_type": "natural earth", "lataxis_range": [-60,85]}})
-    fig.update_layout(l_map)
-  else:
-    fig=make_fig_1(selection)
-  return fig
-
-#callback for top n abs
-@app.callback(
-  Output('top_10_abs', 'figure'),
-  [Input('metric-select-abs', 'value')])
-def update_chart(metric):
-  fig= make_fig_3(master_elec, metric, "lastValue",1)
-  fig.update_layout(xaxis_title= "billion kWh")
-  return fig
-
-@app.callback(
-  Output('top_10_ren', 'figure'),
-  [Input('metric-select-cap', 'value')])
-def update_chart(metric):
-  fig= make_fig_3(master_elec, metric, "kWh PP",0)
-  fig.update_layout(xaxis_title= "thousand kWh PP")
-  return fig
-
-@app.callback(
-  Output('top_10_dep', 'figure'),
-  [Input('metric-select-dep', 'value')])
-def update_chart(metric):
-  fig= make_fig_3(df_dep, metric, "dependence",0)
-  fig.update_layout(xaxis_title= "fraction of power base")
-  return fig
+  [Output('ww_title', 'children'),
+   Output('country_title', 'children')],
+  [Input('year-select', 'value')])
+def update_chart(year):
+  year=year or display_year
+  return ["Worldwide, as of {}".format(year), "By country, as of {}".format(year)]
+
+#the map and top n panels are driven either from the server or, with
+#CLIENTSIDE_CALLBACKS, from the view-data store; never both, as an output
+#can only have one callback. unless the layout is lazy, the page already
+#carries the default figures, and their callbacks do not fire on load
+if not clientside_callbacks:
+  @app.callback(
+    Output('world_map', 'figure'),
+    [Input('metric-select-ww', 'value'),
+     Input('year-select', 'value'),
+     Input('map-animate', 'value')],
+    prevent_initial_call=not lazy_layout)
+  def update_chart(selection, year, animate):
+    if animate:
+      return cached_figure("world_map_anim", selection)
+    return cached_figure("world_map", (selection, year or display_year))
+
+  #callback for top n abs
+  @app.callback(
+    Output('top_10_abs', 'figure'),
+    [Input('metric-select-abs', 'value'),
+     Input('year-select', 'value')],
+    prevent_initial_call=not lazy_layout)
+  def update_chart(metric, year):
+    return cached_figure("top_10_abs", (metric, year or display_year))
+
+  @app.callback(
+    Output('top_10_ren', 'figure'),
+    [Input('metric-select-cap', 'value'),
+     Input('year-select', 'value')],
+    prevent_initial_call=not lazy_layout)
+  def update_chart(metric, year):
+    return cached_figure("top_10_ren", (metric, year or display_year))
+
+  @app.callback(
+    Output('top_10_dep', 'figure'),
+    [Input('metric-select-dep', 'value'),
+     Input('year-select', 'value')],
+    prevent_initial_call=not lazy_layout)
+  def update_chart(metric, year):
+    return cached_figure("top_10_dep", (metric, year or display_year))
+
+else:
+  #the store is filled with the page unless the layout is lazy
+  @app.callback(
+    Output('view-data', 'data'),
+    [Input('year-select', 'value')],
+    prevent_initial_call=not lazy_layout)
+  def update_chart(year):
+    return view_data(year or display_year)
+
+  @app.callback(
+    Output('map-anim', 'data'),
+    [Input('metric-select-ww', 'value'),
+     Input('map-animate', 'value')])
+  def update_chart(selection, animate):
+    if not animate:
+      return dash.no_update
+    return {"mode": selection, "figure": cached_figure("world_map_anim", selection)}
+
+  app.clientside_callback(
+    ClientsideFunction(namespace="elec", function_name="world_map"),
+    Output('world_map', 'figure'),
+    [Input('metric-select-ww', 'value'),
+     Input('map-animate', 'value'),
+     Input('view-data', 'data'),
+     Input('map-anim', 'data')])
+
+  for chart, dropdown in [("top_10_abs", "metric-select-abs"), ("top_10_ren", "metric-select-cap"), ("top_10_dep", "metric-select-dep")]:
+    app.clientside_callback(
+      ClientsideFunction(namespace="elec", function_name=chart),
+      Output(chart, 'figure'),
+      [Input(dropdown, 'value'),
+       Input('view-data', 'data')])
 
 @app.callback(
   Output('trend-all', 'figure'),
-  [Input('country-select', 'value')])
+  [Input('country-select', 'value')],
+  prevent_initial_call=not lazy_layout)
 def update_chart(country):
-  fig= make_fig_2(country)
-  fig.update_layout(yaxis_title= "billion kWh")
-  fig.update_layout(title="Total electricity generation: " + country)
-  return fig
+  return cached_figure("trend-all", country)
 
 @app.callback(
   Output('trend-ren', 'figure'),
-  [Input('country-select', 'value')])
+  [Input('country-select', 'value')],
+  prevent_initial_call=not lazy_layout)
 def update_chart(country):
-  fig= make_fig_2b(country)
-  fig.update_layout(yaxis_title= "billion kWh")
-  fig.update_layout(title="Renewables in elec. generation: " +  country)
-  return fig
-
-
-@app.callback(
-  Output('li1', 'children'),
-  [Input('country-select', 'value')])
-def update_chart(country):
-  return "{} billion kWh (net) electricity generated in 2017.".format(f'{master_elec["lastValue"][master_elec["country"]==country][master_elec["label"]=="Total Electricity net generation"].values[0]:,}')
-
-@app.callback(
-  Output('li2', 'children'),
-  [Input('country-select', 'value')])
-def update_chart(country):
-  if df_dom["dominant_source"][df_dom["country"]==country].values[0]=='Nuclear':
-    statement="Nuclear power is the dominant power source for electricity generation."
-  elif df_dom["dominant_source"][df_dom["country"]==country].values[0]=='Fossil fuels':
-    statement= "Fossil fuels are the dominant power source for electricity generation."
-  else:
-    statement="Renewables are the dominant power source for electricity generation."
-  return statement
+  return cached_figure("trend-ren", country)
 
-@app.callback(
-  Output('li3', 'children'),
-  [Input('country-select', 'value')])
-def update_chart(country):
-  return "Renewables constitute {}% of the power base used for electricity generation.".format(round(100*df_dep["dependence"][df_dep["label"]=="Renewable"][df_dep["country"]==country].values[0],1))
 
 @app.callback(
-  Output('li21', 'children'),
-  [Input('country-select', 'value')])
-def update_chart(country):
-  if df_dep["dependence"][df_dep["label"]=="Renewable"][df_dep["country"]==country].values[0]==0:
-    statement="Zero renewables in electricity generation mix as of 2017."
-  else:
-    statement="{} billion kWh electricity generated from renewable sources.".format(f'{round(master_elec[master_elec["country"]==country][master_elec["label"]=="Renewable"]["lastValue"].values[0],2):,}')
-  return statement
-
-@app.callback(
-  Output('li22', 'children'),
-  [Input('country-select', 'value')])
-def update_chart(country):
-  if country=="World":
-    statement="{} is the dominant renewable power source.".format(master_elec[master_elec["country"]==country][master_elec["label"].isin(ren)].sort_values(by="lastValue")["label"].iloc[-1])
-  elif df_dep["dependence"][df_dep["label"]=="Renewable"][df_dep["country"]==country].values[0]==0:
-    statement=""
-  else:
-    subset=master_elec[master_elec["label"]=="Renewable"]
-    rank=int(subset.rank(method="max", ascending=False)["lastValue"].loc[subset[subset["country"]==country].index.values[0]]-1)
-    statement="Ranked number {} globally for total quantity of renewable power generated.".format(rank)
-  return statement
-
-@app.callback(
-  Output('li23', 'children'),
-  [Input('country-select', 'value')])
-def update_chart(country):
-  if country=="World":
-    statement="{} is the fastest growing renewable power source, followed by {}.".format(df_growth[df_growth["country"]==country].sort_values(by="growth")["label"].iloc[-1],df_growth[df_growth["country"]==country].sort_values(by="growth")["label"].iloc[-2])
-  elif df_dep["dependence"][df_dep["label"]=="Renewable"][df_dep["country"]==country].values[0]==0:
-    statement=""
-  else:
-    statement="{} is the dominant renewable power source.".format(df_dep[df_dep["country"]==country][df_dep["label"].isin(ren)].sort_values(by="dependence")["label"].iloc[-1])
-  return statement
+  [Output('li1', 'children'),
+   Output('li2', 'children'),
+   Output('li3', 'children'),
+   Output('li21', 'children'),
+   Output('li22', 'children'),
+   Output('li23', 'children')],
+  [Input('country-select', 'value'),
+   Input('year-select', 'value')])
+def update_chart(country, year):
+  return country_summary(country, year)
+
+
+@server.route("/cache-stats")
+def cache_stats():
+  return dict(figure_cache.stats(), startup_seconds=startup_seconds)
+
+#CALLBACK METRICS
+#every callback request is timed per output: wall time, the part spent
+#building and serializing figures, the figure cache outcome and the
+#uncompressed response size (measured before the response is gzipped).
+#served at /metrics in prometheus text format and, sizes only, at
+#/payload-stats. with PROFILE_REQUESTS set, a request carrying an
+#X-Profile header is run under cProfile; its stats are printed and, with
+#PROFILE_DIR set, saved there
+callback_metrics=CallbackMetrics()
+profile_requests=bool(os.environ.get("PROFILE_REQUESTS"))
+profile_dir=os.environ.get("PROFILE_DIR")
+
+def profile_path(output):
+  #the output id comes from the client: only its safe characters are kept,
+  #with a hash of it to tell apart ids that differ in the others, and the
+  #file must land in PROFILE_DIR
+  output=str(output)
+  name=re.sub(r"[^A-Za-z0-9_-]+", "_", output).strip("_")[:80]
+  path=os.path.join(profile_dir, "{}-{}-{}.prof".format(name, hashlib.sha1(output.encode()).hexdigest()[:8], int(time.time()*1000)))
+  if os.path.dirname(os.path.realpath(path))!=os.path.realpath(profile_dir):
+    return None
+  return path
+
+def is_callback_request():
+  return request.path.endswith("/_dash-update-component")
+
+@server.before_request
+def start_callback_timer():
+  if is_callback_request():
+    g.timings=new_timings()
+    g.begin=time.perf_counter()
+  if profile_requests and request.headers.get("X-Profile"):
+    g.profiler=cProfile.Profile()
+    g.profiler.enable()
+
+@server.after_request
+def record_callback_metrics(response):
+  profiler=g.get("profiler")
+  if profiler is not None:
+    profiler.disable()
+    output=(request.get_json(silent=True) or {}).get("output", request.path)
+    stats=pstats.Stats(profiler)
+    path=profile_path(output) if profile_dir else None
+    if path:
+      stats.dump_stats(path)
+    print("profile of {}:".format(output), flush=True)
+    stats.sort_stats("cumulative").print_stats(25)
+  if is_callback_request() and "timings" in g:
+    output=(request.get_json(silent=True) or {}).get("output")
+    size=len(response.get_data()) if not response.direct_passthrough else 0
+    callback_metrics.record(output, time.perf_counter()-g.begin, g.timings, size)
+  return response
+
+@server.route("/metrics")
+def prometheus_metrics():
+  stats=figure_cache.stats()
+  gauges={
+    "elec_figure_cache_entries": ("Figures held in this worker's cache.", stats["size"]),
+    "elec_figure_cache_hits": ("Figure cache hits in this worker.", stats["hits"]),
+    "elec_figure_cache_shared_hits": ("Figures read from the shared store by this worker.", stats["shared_hits"]),
+    "elec_figure_cache_misses": ("Figures rendered by this worker.", stats["misses"]),
+    "elec_startup_seconds": ("Time from import to ready.", startup_seconds),
+  }
+  return Response(callback_metrics.prometheus_text(gauges), mimetype="text/plain; version=0.0.4")
+
+@server.route("/payload-stats")
+def payload_sizes():
+  return callback_metrics.payload_stats()
+
+#MEMORY
+#resident footprint of this worker and of the data it holds, in bytes.
+#series arrays read from the data build are memory-mapped, so their pages
+#are shared between the workers; under gunicorn_preload.py everything loaded
+#before the fork is
+def resident_bytes():
+  try:
+    with open("/proc/self/status") as f:
+      for line in f:
+        if line.startswith("VmRSS:"):
+          return int(line.split()[1])*1024
+  except OSError:
+    pass
+  import resource
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def process_memory(pid="self"):
+  #resident bytes of a process and how they split: pss charges each shared
+  #page to its sharers in equal parts, private pages are the ones only this
+  #process maps (for a forked worker, the ones it has copied or allocated
+  #itself). None where /proc/<pid>/smaps_rollup is not available
+  fields={}
+  try:
+    with open("/proc/{}/smaps_rollup".format(pid)) as f:
+      for line in f:
+        parts=line.split()
+        if len(parts)==3 and parts[2]=="kB":
+          fields[parts[0].rstrip(":")]=int(parts[1])*1024
+  except OSError:
+    return {"rss": resident_bytes() if pid=="self" else None, "pss": None, "shared": None, "private": None}
+  return {
+    "rss": fields["Rss"],
+    "pss": fields["Pss"],
+    "shared": fields["Shared_Clean"]+fields["Shared_Dirty"],
+    "private": fields["Private_Clean"]+fields["Private_Dirty"],
+  }
+
+def memory_report():
+  d=app_data
+  s=d.data.series
+  report=process_memory()
+  report.update({
+    "pid": os.getpid(),
+    "compact": compact_memory,
+    "tables": int(sum(t.memory_usage(deep=True).sum() for t in d.tables.values())),
+    "source_tables": int(sum(t.memory_usage(deep=True).sum() for t in d.data.tables.values())) if d.data.tables is not d.tables else 0,
+    "series": int(sum(a.nbytes for a in [s.offsets, s.dates, s.values])),
+    "series_mapped": isinstance(s.values, np.memmap),
+    "cube": int(sum(a.nbytes for a in d._cube.arrays.values())+d._cube.present.nbytes+d._cube.dominant.nbytes) if d._cube is not None else 0,
+    "year_views": len(d._views),
+    "figure_cache": figure_cache.stats()["bytes"],
+  })
+  return report
+
+@server.route("/memory-stats")
+def memory_stats():
+  return memory_report()
+
+if os.environ.get("WARM_FIGURE_CACHE"):
+  warm_figure_cache()
+
+startup_seconds=time.perf_counter()-startup_begin
+print("app1 ready in {:.3f}s (data: {}, version {})".format(startup_seconds, app_data.data.source, app_data.version), flush=True)
 
 
 if __name__ == '__main__':
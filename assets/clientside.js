@@ -0,0 +1,42 @@
+//view switches served from the view-data store when the app runs with
+//CLIENTSIDE_CALLBACKS (see app1.py)
+(function() {
+  //the chart's figure with the bars of one label swapped in
+  function bars(chart) {
+    return function(label, data) {
+      if (!data || !data.bars[chart].labels[label]) {
+        return window.dash_clientside.no_update;
+      }
+      var fig=data.bars[chart].figure;
+      var yx=data.bars[chart].labels[label];
+      var trace=Object.assign({}, fig.data[0], {
+        y: yx[0],
+        x: yx[1],
+        marker: Object.assign({}, fig.data[0].marker, {color: data.colors[label]})
+      });
+      return Object.assign({}, fig, {data: [trace]});
+    };
+  }
+
+  window.dash_clientside=Object.assign({}, window.dash_clientside, {
+    elec: {
+      world_map: function(selection, animate, data, anim) {
+        //the animated figure comes from the server; wait for the one of
+        //the selected mode
+        if (animate && animate.length) {
+          if (anim && anim.mode===selection) {
+            return anim.figure;
+          }
+          return window.dash_clientside.no_update;
+        }
+        if (!data) {
+          return window.dash_clientside.no_update;
+        }
+        return data.maps[selection];
+      },
+      top_10_abs: bars("top_10_abs"),
+      top_10_ren: bars("top_10_ren"),
+      top_10_dep: bars("top_10_dep")
+    }
+  });
+})();
@@ -0,0 +1,223 @@
+#benchmarks for the dashboard: startup, figure building and callback
+#throughput. results are written as JSON so runs on different commits can be
+#compared:
+#
+#    python benchmarks/bench.py run [--out FILE]
+#    python benchmarks/bench.py compare BASE.json NEW.json
+#
+#the app reads its environment variables as usual, so a run measures the
+#configuration it is started with
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#environment variables recorded with each run, as they change what is measured
+config_vars=["METRICS_YEAR", "TOP_N", "LAZY_LAYOUT", "CLIENTSIDE_CALLBACKS", "FIGURE_CACHE_SIZE", "FIGURE_CACHE_DB", "WARM_FIGURE_CACHE", "DATA_REFRESH_INTERVAL"]
+
+
+def summarize(seconds):
+  seconds=sorted(seconds)
+  return {
+    "n": len(seconds),
+    "mean_ms": 1000*statistics.mean(seconds),
+    "p50_ms": 1000*seconds[len(seconds)//2],
+    "p95_ms": 1000*seconds[min(len(seconds)-1, int(0.95*len(seconds)))],
+    "max_ms": 1000*seconds[-1],
+  }
+
+
+def git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def bench_startup(runs):
+  #a fresh interpreter per run: wall time of `import app1`, and the startup
+  #time app1 reports itself
+  code="import time; t=time.perf_counter(); import app1; print('BENCH', time.perf_counter()-t, app1.startup_seconds)"
+  wall, reported=[], []
+  for _ in range(runs):
+    out=subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True).stdout
+    line=[l for l in out.splitlines() if l.startswith("BENCH ")][-1].split()
+    wall.append(float(line[1]))
+    reported.append(float(line[2]))
+  return {"import": summarize(wall), "reported": summarize(reported)}
+
+
+def bench_figures(app1, repeat):
+  #the builders called directly, past the figure cache, over every country
+  #and label; building and serializing are timed apart. one untimed call
+  #first, so plotly's lazily imported validators are not counted
+  countries=[c["value"] for c in app1.app_data.countries]
+  labels=[m["value"] for m in app1.metrics_max]
+  cases={
+    "make_fig_1a": [()],
+    "make_fig_1": [("lastValue",), ("kWh PP",)],
+    "make_fig_2": [(c,) for c in countries],
+    "make_fig_2b": [(c,) for c in countries],
+    "make_fig_3": [(l, metric, metric=="lastValue") for l in labels for metric in ["lastValue", "kWh PP", "dependence"]],
+  }
+  results={}
+  for name, calls in cases.items():
+    build, serialize=[], []
+    getattr(app1, name)(*calls[0]).to_json()
+    for _ in range(repeat):
+      for args in calls:
+        begin=time.perf_counter()
+        fig=getattr(app1, name)(*args)
+        built=time.perf_counter()
+        fig.to_json()
+        build.append(built-begin)
+        serialize.append(time.perf_counter()-built)
+    results[name]={"build": summarize(build), "to_json": summarize(serialize)}
+  return results
+
+
+def output_name(output):
+  #"..li1.children...li2.children.." -> "li1+li2"
+  return "+".join(o.split(".")[0] for o in output.strip(".").split("..."))
+
+
+def callback_requests(app1):
+  #one request per value of each server callback's first input, the other
+  #inputs at their defaults, as the browser would send them
+  values={
+    "country-select": [c["value"] for c in app1.app_data.countries],
+    "metric-select-ww": [m["value"] for m in app1.metrics],
+    "metric-select-abs": [m["value"] for m in app1.metrics_max],
+    "metric-select-cap": [m["value"] for m in app1.metrics_max],
+    "metric-select-dep": [m["value"] for m in app1.metrics_max[:-1]],
+    "year-select": app1.app_data.years,
+    "map-animate": [[]],
+  }
+  requests=[]
+  for output, cb in app1.app.callback_map.items():
+    if "callback" not in cb:
+      continue
+    ids=[i["id"] for i in cb["inputs"]]
+    if not all(i in values for i in ids):
+      continue
+    if output.startswith(".."):
+      outputs=[{"id": o.split(".")[0], "property": o.split(".")[1]} for o in output.strip(".").split("...")]
+    else:
+      outputs={"id": output.split(".")[0], "property": output.split(".")[1]}
+    for value in values[ids[0]]:
+      inputs=[{"id": i["id"], "property": i["property"], "value": value if n==0 else values[i["id"]][0]} for n, i in enumerate(cb["inputs"])]
+      if "year-select" in ids[1:]:
+        inputs[ids.index("year-select")]["value"]=app1.display_year
+      requests.append((output_name(output), {"output": output, "outputs": outputs, "inputs": inputs, "changedPropIds": [ids[0]+".value"], "state": []}))
+  return requests
+
+
+def bench_callbacks(app1, passes):
+  #every request through flask's test client: the first pass starts from an
+  #empty figure cache ("cold"), the later ones are served from it ("warm")
+  client=app1.server.test_client()
+  requests=callback_requests(app1)
+  results={}
+  for name, runs in [("cold", 1), ("warm", passes-1)]:
+    latency={}
+    begin=time.perf_counter()
+    for _ in range(runs):
+      for output, body in requests:
+        t=time.perf_counter()
+        r=client.post("/_dash-update-component", json=body)
+        latency.setdefault(output, []).append(time.perf_counter()-t)
+        if r.status_code not in (200, 204):
+          raise SystemExit("{} returned {}".format(output, r.status_code))
+    seconds=time.perf_counter()-begin
+    if runs:
+      results[name]={
+        "requests": runs*len(requests),
+        "seconds": seconds,
+        "requests_per_second": runs*len(requests)/seconds,
+        "outputs": {output: summarize(s) for output, s in latency.items()},
+      }
+  return results
+
+
+def run(args):
+  os.chdir(root)
+  sys.path.insert(0, root)
+  results={
+    "commit": git_commit(),
+    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "config": {k: os.environ[k] for k in config_vars if k in os.environ},
+    "startup": bench_startup(args.startup_runs),
+  }
+  import app1
+  app1.figure_cache.maxsize=max(app1.figure_cache.maxsize, 100000)
+  results["data"]={"source": app1.app_data.data.source, "version": app1.app_data.version, "countries": len(app1.app_data.countries)}
+  results["figures"]=bench_figures(app1, args.repeat)
+  results["callbacks"]=bench_callbacks(app1, args.passes)
+
+  out=args.out or os.path.join(root, "benchmarks", "results", "{}.json".format(results["commit"] or "results"))
+  os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+  with open(out, "w") as f:
+    json.dump(results, f, indent=1)
+  print("wrote {}".format(out))
+
+
+def flatten(results):
+  #the headline numbers of a run, by name
+  flat={
+    "startup.import.mean_ms": results["startup"]["import"]["mean_ms"],
+    "startup.reported.mean_ms": results["startup"]["reported"]["mean_ms"],
+  }
+  for name, r in results["figures"].items():
+    for phase in ["build", "to_json"]:
+      flat["figures.{}.{}.mean_ms".format(name, phase)]=r[phase]["mean_ms"]
+      flat["figures.{}.{}.p95_ms".format(name, phase)]=r[phase]["p95_ms"]
+  for name, r in results["callbacks"].items():
+    flat["callbacks.{}.requests_per_second".format(name)]=r["requests_per_second"]
+    for output, s in r["outputs"].items():
+      flat["callbacks.{}.{}.p95_ms".format(name, output)]=s["p95_ms"]
+  return flat
+
+
+def compare(args):
+  with open(args.base) as f:
+    base=json.load(f)
+  with open(args.new) as f:
+    new=json.load(f)
+  print("{} -> {}".format(base.get("commit"), new.get("commit")))
+  if base.get("config")!=new.get("config"):
+    print("note: runs used different settings: {} / {}".format(base.get("config"), new.get("config")))
+  a, b=flatten(base), flatten(new)
+  width=max(len(k) for k in a)
+  for name in a:
+    if name not in b:
+      continue
+    change=(b[name]/a[name]-1)*100 if a[name] else float("nan")
+    print("{:<{}}  {:>10.2f}  {:>10.2f}  {:>+7.1f}%".format(name, width, a[name], b[name], change))
+
+
+if __name__=="__main__":
+  parser=argparse.ArgumentParser(description="Benchmarks for the dashboard.")
+  commands=parser.add_subparsers(dest="command", required=True)
+  p=commands.add_parser("run", help="run the benchmarks and write the results as JSON")
+  p.add_argument("--out", help="results file (default: benchmarks/results/<commit>.json)")
+  p.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters started (default 5)")
+  p.add_argument("--repeat", type=int, default=3, help="calls of each figure builder per case (default 3)")
+  p.add_argument("--passes", type=int, default=3, help="passes over the callback requests, the first one cold (default 3)")
+  p=commands.add_parser("compare", help="compare two results files")
+  p.add_argument("base")
+  p.add_argument("new")
+  args=parser.parse_args()
+  if args.command=="run":
+    run(args)
+  else:
+    compare(args)
@@ -0,0 +1,125 @@
+#callback latency under concurrent users, against gunicorn serving
+#app1:server with sync workers (gunicorn_preload.py) and with threaded ones
+#(gunicorn_threaded.py). each simulated user makes selections back to back
+#(a country, map mode, label or year, picked at random) and sends every
+#callback a selection fires at once, as the browser does. a selection is
+#done when its last response has arrived, which is what the user waits for.
+#both servers start with an empty figure cache and get the same selections:
+#
+#    python benchmarks/loadtest.py [--users N] [--selections N] [--workers N] [--threads N] [--out FILE]
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+modes={
+  "sync": os.path.join(root, "gunicorn_preload.py"),
+  "gthread": os.path.join(root, "gunicorn_threaded.py"),
+}
+
+
+def selections(requests):
+  #the callback requests grouped by the input change that fires them
+  groups=OrderedDict()
+  for output, body in requests:
+    changed=body["changedPropIds"][0]
+    value=[i["value"] for i in body["inputs"] if i["id"]+"."+i["property"]==changed][0]
+    groups.setdefault((changed, json.dumps(value)), []).append((output, body))
+  return list(groups.values())
+
+
+def load(plan, port, summarize):
+  url="http://127.0.0.1:{}/_dash-update-component".format(port)
+  lock=threading.Lock()
+  outputs, waits=OrderedDict(), []
+
+  def post(body):
+    begin=time.perf_counter()
+    r=urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(r) as response:
+      response.read()
+    return time.perf_counter()-begin
+
+  senders=ThreadPoolExecutor(len(plan)*max(len(group) for steps in plan for group in steps))
+  def user(steps):
+    for group in steps:
+      begin=time.perf_counter()
+      sent=[(output, senders.submit(post, body)) for output, body in group]
+      seconds=[(output, f.result()) for output, f in sent]
+      with lock:
+        waits.append(time.perf_counter()-begin)
+        for output, s in seconds:
+          outputs.setdefault(output, []).append(s)
+
+  begin=time.perf_counter()
+  with ThreadPoolExecutor(len(plan)) as users:
+    list(users.map(user, plan))
+  elapsed=time.perf_counter()-begin
+  senders.shutdown()
+  latency=[s for seconds in outputs.values() for s in seconds]
+  return {
+    "seconds": elapsed,
+    "requests": len(latency),
+    "requests_per_second": len(latency)/elapsed,
+    "selections": summarize(waits),
+    "latency": summarize(latency),
+    "outputs": {output: summarize(s) for output, s in outputs.items()},
+  }
+
+
+def run(mode, plan, args, summarize, start):
+  port=args.port+(mode=="gthread")
+  options=["-c", modes[mode]]+(["--threads", str(args.threads)] if mode=="gthread" else [])
+  with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as log:
+    proc=start(options, args.workers, port, log, True)
+    try:
+      result=load(plan, port, summarize)
+    finally:
+      proc.terminate()
+      proc.wait()
+  os.remove(log.name)
+  return result
+
+
+if __name__=="__main__":
+  parser=argparse.ArgumentParser(description="Callback latency under concurrent users, sync and threaded workers.")
+  parser.add_argument("--users", type=int, default=16, help="concurrent users (default 16)")
+  parser.add_argument("--selections", type=int, default=20, help="selections per user (default 20)")
+  parser.add_argument("--workers", type=int, default=2, help="gunicorn workers (default 2)")
+  parser.add_argument("--threads", type=int, default=4, help="threads per gthread worker (default 4)")
+  parser.add_argument("--seed", type=int, default=0, help="seed of the users' selections (default 0)")
+  parser.add_argument("--port", type=int, default=8775, help="ports used: this one and the next (default 8775)")
+  parser.add_argument("--out", help="also write the results to this JSON file")
+  args=parser.parse_args()
+
+  os.chdir(root)
+  import app1
+  from bench import callback_requests, summarize
+  from workers import start
+  groups=selections(callback_requests(app1))
+  rng=random.Random(args.seed)
+  plan=[[rng.choice(groups) for _ in range(args.selections)] for _ in range(args.users)]
+
+  results={mode: run(mode, plan, args, summarize, start) for mode in modes}
+  print("{} users x {} selections, {} workers ({} threads each under gthread), ms".format(args.users, args.selections, args.workers, args.threads))
+  columns=["select p50", "select p95", "select max", "request p50", "request p95", "requests/s"]
+  print("{:<10}".format("")+"".join("{:>13}".format(c) for c in columns))
+  for mode, r in results.items():
+    values=[r["selections"]["p50_ms"], r["selections"]["p95_ms"], r["selections"]["max_ms"],
+      r["latency"]["p50_ms"], r["latency"]["p95_ms"], r["requests_per_second"]]
+    print("{:<10}".format(mode)+"".join("{:>13.1f}".format(v) for v in values))
+  if args.out:
+    with open(args.out, "w") as f:
+      json.dump(dict(results, config=vars(args)), f, indent=1)
@@ -0,0 +1,56 @@
+#per-worker memory footprint with and without COMPACT_MEMORY. each mode runs
+#in a fresh interpreter, which imports app1, reports its footprint, then
+#serves every figure of the selected years (as a long-running worker would)
+#and reports again:
+#
+#    python benchmarks/memory.py [--years N] [--out FILE]
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+worker="""
+import json, sys
+import app1
+report={"startup": app1.memory_report()}
+years=app1.app_data.years[:int(sys.argv[1])]
+for chart, key in app1.figure_keys(years):
+  app1.cached_figure(chart, key)
+for year in years:
+  for c in app1.app_data.countries:
+    app1.country_summary(c["value"], year)
+report["served"]=app1.memory_report()
+print("MEMORY "+json.dumps(report))
+"""
+
+
+def measure(compact, years):
+  env=dict(os.environ)
+  env.pop("COMPACT_MEMORY", None)
+  if compact:
+    env["COMPACT_MEMORY"]="1"
+  out=subprocess.run([sys.executable, "-c", worker, str(years)], cwd=root, env=env, capture_output=True, text=True, check=True).stdout
+  return json.loads([l for l in out.splitlines() if l.startswith("MEMORY ")][-1][len("MEMORY "):])
+
+
+if __name__=="__main__":
+  parser=argparse.ArgumentParser(description="Per-worker memory footprint with and without COMPACT_MEMORY.")
+  parser.add_argument("--years", type=int, default=1000, help="years whose figures are served (default: all)")
+  parser.add_argument("--out", help="also write the reports to this JSON file")
+  args=parser.parse_args()
+
+  results={"default": measure(False, args.years), "compact": measure(True, args.years)}
+  rows=["rss", "tables", "source_tables", "series", "cube", "figure_cache", "year_views"]
+  print("{:<14} {:>12} {:>12} {:>12} {:>12}".format("MB", "default", "compact", "default", "compact"))
+  print("{:<14} {:>25} {:>25}".format("", "at startup", "after serving"))
+  for row in rows:
+    scale=1 if row=="year_views" else 1/2**20
+    values=[results[mode][phase][row]*scale for phase in ["startup", "served"] for mode in ["default", "compact"]]
+    print("{:<14} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}".format(row if scale!=1 else row+" (n)", *values))
+  if args.out:
+    with open(args.out, "w") as f:
+      json.dump(results, f, indent=1)
@@ -0,0 +1,129 @@
+#host memory of a gunicorn deployment with N workers, started the way the
+#Procfile does (every worker loads the data itself) and with
+#gunicorn_preload.py (loaded once in the master and shared with the forked
+#workers). every process is measured from /proc/<pid>/smaps_rollup once the
+#workers are up and again after the callback requests of bench.py have been
+#sent through them; the summed pss is what the deployment costs the host:
+#
+#    python benchmarks/workers.py [--workers N] [--passes N] [--out FILE]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+modes={
+  "plain": [],
+  "preload": ["-c", os.path.join(root, "gunicorn_preload.py")],
+}
+
+
+def children(pid):
+  with open("/proc/{}/task/{}/children".format(pid, pid)) as f:
+    return [int(p) for p in f.read().split()]
+
+
+def start(options, workers, port, log, preload):
+  #a plain worker that warms the figure cache would outlive gunicorn's
+  #default 30s boot timeout
+  cmd=[sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()", "-w", str(workers),
+    "-b", "127.0.0.1:{}".format(port), "-t", "600"]+options+["app1:server"]
+  proc=subprocess.Popen(cmd, cwd=root, stdout=log, stderr=subprocess.STDOUT)
+  #app1 prints its ready line in every process that loads the data: the
+  #master with preload, each worker without
+  loads=1 if preload else workers
+  deadline=time.time()+600
+  while time.time()<deadline:
+    if proc.poll() is not None:
+      raise SystemExit("gunicorn exited, see {}".format(log.name))
+    with open(log.name) as f:
+      ready=f.read().count("app1 ready in")
+    if ready>=loads and len(children(proc.pid))==workers:
+      time.sleep(1)
+      return proc
+    time.sleep(0.5)
+  proc.kill()
+  raise SystemExit("workers not up after 600s, see {}".format(log.name))
+
+
+def measure(app1, proc):
+  return {
+    "master": app1.process_memory(proc.pid),
+    "workers": [app1.process_memory(pid) for pid in children(proc.pid)],
+  }
+
+
+def serve(requests, port, workers, passes):
+  #from as many threads as there are workers, so every worker takes a share
+  url="http://127.0.0.1:{}/_dash-update-component".format(port)
+  def post(body):
+    r=urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(r) as response:
+      response.read()
+  with ThreadPoolExecutor(workers) as pool:
+    for _ in range(passes):
+      list(pool.map(post, [body for _, body in requests]))
+
+
+def run(mode, app1, requests, args):
+  port=args.port+(mode=="preload")
+  with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as log:
+    proc=start(modes[mode], args.workers, port, log, mode=="preload")
+    try:
+      result={"booted": measure(app1, proc)}
+      serve(requests, port, args.workers, args.passes)
+      result["served"]=measure(app1, proc)
+    finally:
+      proc.terminate()
+      proc.wait()
+  os.remove(log.name)
+  return result
+
+
+def summary(m):
+  #MB: the master, the mean worker, and the host total (pss of them all)
+  mb=lambda b: b/2**20
+  workers=m["workers"]
+  return [
+    mb(m["master"]["rss"]), mb(m["master"]["pss"]),
+    mb(sum(w["rss"] for w in workers)/len(workers)),
+    mb(sum(w["pss"] for w in workers)/len(workers)),
+    mb(sum(w["private"] for w in workers)/len(workers)),
+    mb(m["master"]["pss"]+sum(w["pss"] for w in workers)),
+  ]
+
+
+if __name__=="__main__":
+  parser=argparse.ArgumentParser(description="Host memory of gunicorn workers, with and without preloading.")
+  parser.add_argument("--workers", type=int, default=4, help="gunicorn workers (default 4)")
+  parser.add_argument("--passes", type=int, default=2, help="passes over the callback requests (default 2)")
+  parser.add_argument("--port", type=int, default=8765, help="ports used: this one and the next (default 8765)")
+  parser.add_argument("--out", help="also write the measurements to this JSON file")
+  args=parser.parse_args()
+
+  os.chdir(root)
+  import app1
+  from bench import callback_requests
+  requests=callback_requests(app1)
+  if app1.process_memory()["pss"] is None:
+    raise SystemExit("needs /proc/<pid>/smaps_rollup (linux 4.14+)")
+
+  results={mode: run(mode, app1, requests, args) for mode in modes}
+  columns=["master rss", "master pss", "worker rss", "worker pss", "worker priv", "total pss"]
+  print("{} workers, MB".format(args.workers))
+  print("{:<18}".format("")+"".join("{:>12}".format(c) for c in columns))
+  for mode in modes:
+    for phase in ["booted", "served"]:
+      print("{:<18}".format(mode+", "+phase)+"".join("{:>12.1f}".format(v) for v in summary(results[mode][phase])))
+  if args.out:
+    with open(args.out, "w") as f:
+      json.dump(results, f, indent=1)
@@ -0,0 +1,99 @@
+import threading
+
+
+#upper bounds (seconds) of the request duration histogram
+duration_buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+def new_timings():
+  #running totals for one request, filled in by FigureCache.get
+  return {"build": 0.0, "serialize": 0.0, "cache": set()}
+
+
+def cache_status(outcomes):
+  #one outcome per request: the worst of its figures, or "none" for
+  #callbacks that draw no figure
+  for status in ["miss", "shared", "hit"]:
+    if status in outcomes:
+      return status
+  return "none"
+
+
+def _labels(**labels):
+  return "{"+",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels.items())+"}"
+
+
+#per callback output: request count by cache outcome, a duration histogram,
+#time spent building and serializing figures, and response bytes. kept per
+#worker process
+class CallbackMetrics:
+  def __init__(self):
+    self._lock=threading.Lock()
+    self._outputs={}
+
+  def record(self, output, seconds, timings, size):
+    status=cache_status(timings["cache"])
+    with self._lock:
+      m=self._outputs.get(output)
+      if m is None:
+        m=self._outputs[output]={"requests": {}, "buckets": [0]*len(duration_buckets), "seconds": 0.0,
+          "build": 0.0, "serialize": 0.0, "bytes": 0, "max_bytes": 0}
+      m["requests"][status]=m["requests"].get(status, 0)+1
+      for i, bound in enumerate(duration_buckets):
+        if seconds<=bound:
+          m["buckets"][i]+=1
+      m["seconds"]+=seconds
+      m["build"]+=timings["build"]
+      m["serialize"]+=timings["serialize"]
+      m["bytes"]+=size
+      m["max_bytes"]=max(m["max_bytes"], size)
+
+  def payload_stats(self):
+    with self._lock:
+      stats={}
+      for output, m in self._outputs.items():
+        count=sum(m["requests"].values())
+        stats[output]={"count": count, "bytes": m["bytes"], "max_bytes": m["max_bytes"], "mean_bytes": round(m["bytes"]/count)}
+      return stats
+
+  def prometheus_text(self, gauges=None):
+    #text exposition format, version 0.0.4
+    lines=[
+      "# HELP elec_callback_requests_total Callback requests by output and figure cache outcome.",
+      "# TYPE elec_callback_requests_total counter",
+    ]
+    with self._lock:
+      outputs={output: dict(m, requests=dict(m["requests"]), buckets=list(m["buckets"])) for output, m in self._outputs.items()}
+    for output, m in outputs.items():
+      for status, count in m["requests"].items():
+        lines.append("elec_callback_requests_total{} {}".format(_labels(output=output, cache=status), count))
+
+    lines+=[
+      "# HELP elec_callback_duration_seconds Wall time of callback requests.",
+      "# TYPE elec_callback_duration_seconds histogram",
+    ]
+    for output, m in outputs.items():
+      for bound, count in zip(duration_buckets, m["buckets"]):
+        lines.append("elec_callback_duration_seconds_bucket{} {}".format(_labels(output=output, le=bound), count))
+      lines.append("elec_callback_duration_seconds_bucket{} {}".format(_labels(output=output, le="+Inf"), sum(m["requests"].values())))
+      lines.append("elec_callback_duration_seconds_sum{} {}".format(_labels(output=output), m["seconds"]))
+      lines.append("elec_callback_duration_seconds_count{} {}".format(_labels(output=output), sum(m["requests"].values())))
+
+    lines+=[
+      "# HELP elec_callback_phase_seconds_total Time spent building figures (data work) and serializing them.",
+      "# TYPE elec_callback_phase_seconds_total counter",
+    ]
+    for output, m in outputs.items():
+      for phase in ["build", "serialize"]:
+        lines.append("elec_callback_phase_seconds_total{} {}".format(_labels(output=output, phase=phase), m[phase]))
+
+    lines+=[
+      "# HELP elec_callback_response_bytes_total Uncompressed response bytes.",
+      "# TYPE elec_callback_response_bytes_total counter",
+    ]
+    for output, m in outputs.items():
+      lines.append("elec_callback_response_bytes_total{} {}".format(_labels(output=output), m["bytes"]))
+
+    for name, (help, value) in (gauges or {}).items():
+      lines+=["# HELP {} {}".format(name, help), "# TYPE {} gauge".format(name), "{} {}".format(name, value)]
+    return "\n".join(lines)+"\n"
@@ -0,0 +1,424 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from figure_cache import data_version
+
+
+##############################
+####### SOURCE FILES #########
+##############################
+
+tables={
+  "master_elec": "data/master_elec.csv",
+  "df_dep": "data/elec_dep.csv",
+  "df_dom": "data/dominant_source.csv",
+  "df_growth": "data/df_growth.csv",
+}
+series_file="data/IntElecGen.json"
+source_files=list(tables.values())+[series_file]
+
+#built by `python elec_data.py build`: one flat binary file holding every
+#array back to back, and a manifest with the offset, dtype and shape of each
+artifact_file="data/build/elec_data.bin"
+manifest_file="data/build/manifest.json"
+artifact_format=2
+
+cats=['Solar electricity net generation',
+ 'Nuclear electricity net generation',
+ 'Tide and wave electricity net generation',
+ 'Renewable electricity net generation',
+ 'Hydroelectricity net generation',
+ 'Electricity net generation',
+ 'Non-hydro renewable electricity net generation',
+ 'Hydroelectric pumped storage electricity net generation',
+ 'Solar, tide, wave, fuel cell electricity net generation',
+ 'Wind electricity net generation',
+ 'Geothermal electricity net generation',
+ 'Fossil fuels electricity net generation',
+ 'Biomass and waste electricity net generation']
+
+
+##############################
+####### SERIES CATALOG #######
+##############################
+
+#category -> label used throughout the app
+cat_labels={c: c.split(" electricity net generation")[0] for c in cats}
+cat_labels["Electricity net generation"]="Total Electricity net generation"
+cat_labels["Hydroelectricity net generation"]="Hydroelectricity"
+
+#series are named "<category>, <country>, <frequency>"; the category itself
+#may contain commas ("Solar, tide, wave, fuel cell ..."), so it is matched
+#against the known categories, longest first
+catalog_pattern=re.compile(
+  r"^(?P<cat>" + "|".join(re.escape(c) for c in sorted(cats, key=len, reverse=True)) + r"), (?P<country>.*?)(?:, |$)"
+)
+
+def parse_catalog(names):
+  #category, label and country for every series name in one vectorized
+  #pass; names that match no category get NaN in all three columns
+  parsed=pd.Series(names).str.extract(catalog_pattern)
+  parsed["label"]=parsed["cat"].map(cat_labels)
+  return parsed
+
+def classify_series(df):
+  #adds country and label to a frame of series, dropping (and reporting)
+  #any series whose name matches none of the categories
+  catalog=parse_catalog(df["name"].values)
+  matched=catalog["cat"].notna().values
+  if not matched.all():
+    unmatched=df["name"].values[~matched]
+    print("{} series matched no category and were skipped, e.g. {}".format(
+      len(unmatched), list(unmatched[:5])), file=sys.stderr)
+  df=df[matched].copy()
+  df["country"]=catalog["country"].values[matched]
+  df["label"]=catalog["label"].values[matched]
+  return df
+
+
+#COLUMNAR SERIES STORE
+#flattens the nested {"date", "value"} records once at load so chart builders
+#slice contiguous arrays instead of walking python dicts per request
+class SeriesStore:
+  def __init__(self, country, label, offsets, dates, values):
+    self.country=country
+    self.label=label
+    self.offsets=offsets
+    self.dates=dates
+    self.values=values
+    self.index={}
+    for i, key in enumerate(zip(country, label)):
+      self.index.setdefault(key, i)
+
+  def get(self, country, label):
+    #returns (dates, values) views for one series, empty if it does not exist
+    i=self.index.get((country, label))
+    if i is None:
+      return self.dates[:0], self.values[:0]
+    start, stop=self.offsets[i], self.offsets[i+1]
+    return self.dates[start:stop], self.values[start:stop]
+
+
+def build_series_store(df):
+  lengths=df["data"].map(len).values
+  offsets=np.zeros(len(lengths)+1, dtype=np.int64)
+  np.cumsum(lengths, out=offsets[1:])
+  records=[r for rows in df["data"] for r in rows]
+  dates=np.fromiter((r["date"] for r in records), dtype=np.int64, count=len(records))
+  #sentinels such as "(s)" and "NA" are kept as NaN
+  values=pd.to_numeric(pd.Series([r["value"] for r in records], dtype="object"), errors="coerce").values.astype(np.float64)
+  return SeriesStore(df["country"].values, df["label"].values, offsets, dates, values)
+
+
+class SeriesStoreBuilder:
+  #collects series one at a time, keeping only their typed arrays, and
+  #concatenates them into a SeriesStore at the end
+  def __init__(self):
+    self.country=[]
+    self.label=[]
+    self.lengths=[]
+    self.dates=[]
+    self.values=[]
+
+  def add(self, country, label, dates, values):
+    self.country.append(country)
+    self.label.append(label)
+    self.lengths.append(len(dates))
+    self.dates.append(np.asarray(dates, dtype=np.int64))
+    self.values.append(np.asarray(values, dtype=np.float64))
+
+  def finish(self):
+    offsets=np.zeros(len(self.lengths)+1, dtype=np.int64)
+    np.cumsum(self.lengths, out=offsets[1:])
+    dates=np.concatenate(self.dates) if self.dates else np.zeros(0, dtype=np.int64)
+    values=np.concatenate(self.values) if self.values else np.zeros(0, dtype=np.float64)
+    return SeriesStore(np.array(self.country, dtype=object), np.array(self.label, dtype=object), offsets, dates, values)
+
+
+##############################
+####### BULK INGESTION #######
+##############################
+
+#EIA bulk downloads (e.g. INTL.zip) hold one JSON object per line: category
+#records and series records with "series_id", "name", "f" (frequency) and
+#"data" as [period, value] pairs, newest first. periods look like "2017",
+#"201703" or "2017Q1"
+
+def _period_ms(period):
+  if len(period)==4:
+    month=1
+  elif period[4]=="Q":
+    month=3*int(period[5])-2
+  else:
+    month=int(period[4:6])
+  return int(np.datetime64("{}-{:02d}".format(period[:4], month), "ms").astype(np.int64))
+
+@contextlib.contextmanager
+def open_bulk(path):
+  #text stream over a bulk file, read straight out of the zip if needed; the
+  #archive is closed with the stream
+  if zipfile.is_zipfile(path):
+    with zipfile.ZipFile(path) as z, io.TextIOWrapper(z.open(z.namelist()[0]), encoding="utf-8") as f:
+      yield f
+  else:
+    with open(path, encoding="utf-8") as f:
+      yield f
+
+def ingest_bulk(path, frequency="A"):
+  #reads a bulk file line by line and keeps only the series of the known
+  #categories, so memory is bounded by what is kept, not by the file size
+  builder=SeriesStoreBuilder()
+  with open_bulk(path) as f:
+    for line in f:
+      #cheap text checks before parsing; most lines are other energy series
+      if '"series_id"' not in line or "net generation" not in line:
+        continue
+      s=json.loads(line)
+      if s.get("f")!=frequency:
+        continue
+      m=catalog_pattern.match(s.get("name", ""))
+      if m is None:
+        continue
+      points=sorted(s.get("data", []), key=lambda d: d[0])
+      dates=[_period_ms(p) for p, v in points]
+      #sentinels such as "(s)", "NA" and "--" are kept as NaN
+      values=[v if isinstance(v, (int, float)) else np.nan for p, v in points]
+      builder.add(m.group("country"), cat_labels[m.group("cat")], dates, values)
+  return builder.finish()
+
+
+##############################
+####### LOADED DATA ##########
+##############################
+
+class ElecData:
+  def __init__(self, tables, series, version, source, sources, bulk_file=None):
+    self.tables=tables
+    self.series=series
+    self.version=version
+    #"raw" when parsed from the source files, "artifact" when memory-mapped
+    self.source=source
+    #the files the data was read from
+    self.sources=sources
+    #the EIA bulk file the series came from, None for IntElecGen.json
+    self.bulk_file=bulk_file
+
+
+def load_raw(bulk_file=None):
+  #the series come from IntElecGen.json, or from an EIA bulk file when given
+  loaded={name: pd.read_csv(path) for name, path in tables.items()}
+  if bulk_file:
+    series=ingest_bulk(bulk_file)
+    sources=list(tables.values())+[bulk_file]
+  else:
+    series=build_series_store(classify_series(pd.read_json(series_file)))
+    sources=source_files
+  return ElecData(loaded, series, data_version(sources), "raw", sources, bulk_file)
+
+
+def _file_stamp(path):
+  st=os.stat(path)
+  return {"size": st.st_size, "mtime": st.st_mtime}
+
+def _file_hash(path):
+  h=hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      h.update(chunk)
+  return h.hexdigest()
+
+def _artifact_arrays(data):
+  #flat name -> array mapping of everything the app needs. string columns
+  #become fixed-width unicode so they can be mapped without unpickling;
+  #missing strings are recorded in a separate mask
+  arrays={}
+  for name, t in data.tables.items():
+    for col in t.columns:
+      key="{}/{}".format(name, col)
+      if t[col].dtype==object:
+        na=t[col].isna().values
+        arrays[key]=np.where(na, "", t[col].values).astype("U")
+        if na.any():
+          arrays[key+"/na"]=na
+      else:
+        arrays[key]=t[col].values
+  s=data.series
+  arrays["series/country"]=np.asarray(s.country).astype("U")
+  arrays["series/label"]=np.asarray(s.label).astype("U")
+  arrays["series/offsets"]=s.offsets
+  arrays["series/dates"]=s.dates
+  arrays["series/values"]=s.values
+  return arrays
+
+def write_artifact(data, path=artifact_file, manifest_path=manifest_file):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  entries={}
+  offset=0
+  with open(path+".tmp", "wb") as f:
+    for key, arr in _artifact_arrays(data).items():
+      arr=np.ascontiguousarray(arr)
+      pad=-offset % 64
+      f.write(b"\0"*pad)
+      offset+=pad
+      f.write(arr.tobytes())
+      entries[key]={"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+      offset+=arr.nbytes
+  manifest={
+    "format": artifact_format,
+    "version": data.version,
+    "built": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    "sources": {p: dict(_file_stamp(p), sha256=_file_hash(p)) for p in data.sources},
+    "bulk": data.bulk_file,
+    "tables": {name: list(t.columns) for name, t in data.tables.items()},
+    "arrays": entries,
+  }
+  with open(manifest_path+".tmp", "w") as f:
+    json.dump(manifest, f, indent=1)
+  #the data file goes first so a manifest never points at a missing layout
+  os.replace(path+".tmp", path)
+  os.replace(manifest_path+".tmp", manifest_path)
+  return manifest
+
+
+def read_manifest(manifest_path=manifest_file):
+  if not os.path.exists(manifest_path):
+    return None
+  with open(manifest_path) as f:
+    manifest=json.load(f)
+  if manifest.get("format")!=artifact_format:
+    return None
+  return manifest
+
+def artifact_is_current(manifest):
+  #source files are optional in a deployed slug; each one present must be
+  #the one the artifact was built from. timestamps change on checkout, so a
+  #file whose size or mtime differs is compared by content
+  for path, recorded in manifest["sources"].items():
+    if not os.path.exists(path):
+      continue
+    stamp=_file_stamp(path)
+    if (stamp["size"], stamp["mtime"])==(recorded["size"], recorded["mtime"]):
+      continue
+    if _file_hash(path)!=recorded["sha256"]:
+      return False
+  return True
+
+def load_artifact(manifest, path=artifact_file):
+  buf=np.memmap(path, dtype=np.uint8, mode="r")
+
+  def array(key):
+    e=manifest["arrays"][key]
+    dtype=np.dtype(e["dtype"])
+    n=int(np.prod(e["shape"]))*dtype.itemsize
+    return buf[e["offset"]:e["offset"]+n].view(dtype).reshape(e["shape"])
+
+  loaded={}
+  for name, columns in manifest["tables"].items():
+    cols={}
+    for col in columns:
+      key="{}/{}".format(name, col)
+      arr=array(key)
+      if arr.dtype.kind=="U":
+        arr=arr.astype(object)
+        if key+"/na" in manifest["arrays"]:
+          arr[array(key+"/na")]=np.nan
+      cols[col]=arr
+    loaded[name]=pd.DataFrame(cols, columns=columns)
+
+  series=SeriesStore(array("series/country"), array("series/label"), array("series/offsets"),
+    array("series/dates"), array("series/values"))
+  return ElecData(loaded, series, manifest["version"], "artifact", list(manifest["sources"]), manifest.get("bulk"))
+
+
+def _bulk_file(manifest):
+  #the bulk file the current build was made from, if any
+  return manifest.get("bulk") if manifest else None
+
+def data_stamp():
+  #cheap fingerprint (sizes and mtimes) of every file load_data may read
+  paths=[manifest_file, artifact_file]+source_files
+  bulk=_bulk_file(read_manifest())
+  if bulk:
+    paths.append(bulk)
+  return tuple(_file_stamp(p) if os.path.exists(p) else None for p in paths)
+
+#columns of the csv tables the app never reads
+unused_columns={"df_dep": ["level"], "df_growth": ["Unnamed: 0"]}
+
+def compact_tables(tables):
+  #repeated strings (country, label, iso, dominant source) as categoricals,
+  #and the unread columns dropped. the numeric columns stay float64, as each
+  #of them is shown or ranked at full precision
+  compact={}
+  for name, df in tables.items():
+    df=df.drop(columns=[c for c in unused_columns.get(name, []) if c in df.columns])
+    compact[name]=df.astype({c: "category" for c in df.columns if df[c].dtype==object})
+  return compact
+
+def load_data(compact=False):
+  #the prebuilt artifact when there is a current one, the source files otherwise.
+  #a build made from a bulk file is rebuilt from that file, never from
+  #IntElecGen.json; while the bulk file is missing the build is kept
+  stamp=data_stamp()
+  manifest=read_manifest()
+  bulk=_bulk_file(manifest)
+  if manifest and os.path.exists(artifact_file) and artifact_is_current(manifest):
+    data=load_artifact(manifest)
+  elif bulk and not os.path.exists(bulk) and os.path.exists(artifact_file):
+    print("{} is out of date but its bulk file {} is missing; keeping it until it is rebuilt".format(
+      artifact_file, bulk), file=sys.stderr)
+    data=load_artifact(manifest)
+  else:
+    data=load_raw(bulk)
+  if compact:
+    data.tables=compact_tables(data.tables)
+  data.stamp=stamp
+  return data
+
+
+def changed_countries(old, new):
+  #countries whose series or table rows differ between two loads, including
+  #countries that were added or removed
+  changed=set()
+  for key in set(old.series.index) | set(new.series.index):
+    d1, v1=old.series.get(*key)
+    d2, v2=new.series.get(*key)
+    if not (np.array_equal(d1, d2) and np.array_equal(v1, v2, equal_nan=True)):
+      changed.add(key[0])
+  for name in tables:
+    t1, t2=old.tables[name], new.tables[name]
+    if list(t1.columns)!=list(t2.columns):
+      return changed | set(t1["country"]) | set(t2["country"])
+    h1=pd.util.hash_pandas_object(t1, index=False).groupby(t1["country"].values).apply(lambda h: sorted(h))
+    h2=pd.util.hash_pandas_object(t2, index=False).groupby(t2["country"].values).apply(lambda h: sorted(h))
+    for country in set(h1.index) | set(h2.index):
+      if country not in h1.index or country not in h2.index or h1[country]!=h2[country]:
+        changed.add(country)
+  return changed
+
+
+def build(bulk_file=None):
+  t=time.perf_counter()
+  data=load_raw(bulk_file)
+  manifest=write_artifact(data)
+  print("built {} ({} series, version {}) in {:.2f}s".format(
+    artifact_file, len(data.series.label), manifest["version"], time.perf_counter()-t))
+
+
+if __name__ == '__main__':
+  parser=argparse.ArgumentParser(description="Build the data artifact the app memory-maps at startup.")
+  parser.add_argument("command", choices=["build"])
+  parser.add_argument("--bulk", metavar="PATH", help="read the series from an EIA bulk file (.txt or .zip) instead of data/IntElecGen.json")
+  args=parser.parse_args()
+  build(args.bulk)
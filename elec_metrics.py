@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+
+
+#hierarchy level of each label, as in elec_dep.csv
+label_levels={
+  "Total Electricity net generation": 0,
+  "Wind": 0,
+  "Fossil fuels": 1,
+  "Nuclear": 1,
+  "Renewable": 1,
+  "Hydroelectric pumped storage": 1,
+  "Hydroelectricity": 2,
+  "Non-hydro renewable": 2,
+  "Biomass and waste": 3,
+  "Geothermal": 3,
+  "Solar, tide, wave, fuel cell": 3,
+  "Solar": 4,
+  "Tide and wave": 4,
+}
+
+#the power base dependence is measured against, and the map score of each
+#dominant source
+base_labels=["Fossil fuels", "Nuclear", "Renewable"]
+source_scores={"Fossil fuels": 1, "Nuclear": 0, "Renewable": -1}
+
+ren=["Hydroelectricity", "Wind", "Biomass and waste", "Solar", "Geothermal", "Tide and wave"]
+
+#growth is measured over this many years
+growth_years=5
+
+#the year of master_elec.csv, whose per-capita column implies the population
+population_year=2017
+
+
+def geo_table(tables):
+  #per-country attributes that do not come from the series: map position and
+  #iso code, and the population implied by the per-capita column
+  #(billion kWh / thousand kWh per person), which is the population of
+  #population_year only
+  total=tables["master_elec"][tables["master_elec"]["label"]=="Total Electricity net generation"]
+  geo=total.drop_duplicates("country").set_index("country")[["lat", "long"]]
+  geo["population"]=(total["lastValue"]/total["kWh PP"]).replace([np.inf, -np.inf], np.nan).groupby(total["country"].values).first()
+  geo["iso"]=tables["df_dom"].drop_duplicates("country").set_index("country")["iso"]
+  return geo
+
+
+class Metrics:
+  #derived metrics for every (country, year) at once. each frame is indexed
+  #by (country, year) with one column per label
+  def __init__(self, value, dependence, per_capita, growth, dominant, geo):
+    self.value=value
+    self.dependence=dependence
+    self.per_capita=per_capita
+    self.growth=growth
+    #(country, year) -> dominant label among base_labels, NaN where none of
+    #them generated anything or was reported
+    self.dominant=dominant
+    self.geo=geo
+    self.years=sorted(value.index.get_level_values("year").unique())
+
+
+def _first_points(series):
+  #mask of the points of the first series stored for each (country, label),
+  #and the series each of those points belongs to
+  lengths=np.diff(series.offsets)
+  first=np.zeros(len(lengths), dtype=bool)
+  first[sorted(series.index.values())]=True
+  keep=np.repeat(first, lengths)
+  return keep, np.repeat(np.arange(len(lengths)), lengths)[keep]
+
+def _point_years(dates):
+  return dates.astype("datetime64[ms]").astype("datetime64[Y]").astype(np.int64)+1970
+
+def series_years(series):
+  #the years compute_metrics gives rows to, without computing the metrics
+  keep, _=_first_points(series)
+  reported=~np.isnan(np.asarray(series.values)[keep])
+  return sorted(set(_point_years(np.asarray(series.dates)[keep][reported]).tolist()))
+
+
+def compute_metrics(series, geo):
+  #one long frame of every point in the store, summed per year so monthly
+  #series work as well as annual ones. a (country, year) whose points are
+  #all sentinels has no data and gets no row; a label whose points in that
+  #year are all sentinels is NaN, and a label with no points is zero
+  keep, idx=_first_points(series)
+  points=pd.DataFrame({
+    "country": np.asarray(series.country, dtype=object)[idx],
+    "label": np.asarray(series.label, dtype=object)[idx],
+    "year": _point_years(np.asarray(series.dates)[keep]),
+    "value": np.asarray(series.values)[keep],
+  })
+  reported=points["value"].notna().groupby([points["country"], points["year"]]).transform("any")
+  points=points[reported.values]
+  value=points.groupby(["country", "year", "label"])["value"].sum(min_count=1).unstack("label", fill_value=0.0)
+
+  #the sum of the base_labels reported, NaN where none of them is. a source
+  #that stops reporting (a "NA" nuclear series, say) mostly means none
+  base=value.reindex(columns=base_labels, fill_value=0.0).sum(axis=1, min_count=1)
+  dependence=value.div(base, axis=0).replace([np.inf, -np.inf], np.nan)
+  #zero where the base is zero, NaN where the value or the base is missing
+  dependence=dependence.mask(dependence.isna() & value.notna() & (base==0).values[:, None], 0.0)
+
+  countries=value.index.get_level_values("country")
+  years=value.index.get_level_values("year")
+
+  #NaN in the years without a population
+  population=geo["population"].reindex(countries).values
+  per_capita=value.div(np.where(years==population_year, population, np.nan), axis=0)
+
+  #NaN where either value is missing, or the base year has no row or a zero
+  #value
+  earlier=value.reindex(pd.MultiIndex.from_arrays([countries, years-growth_years])).values
+  with np.errstate(divide="ignore", invalid="ignore"):
+    growth=pd.DataFrame(value.values/earlier-1, index=value.index, columns=value.columns)
+  growth=growth.replace([np.inf, -np.inf], np.nan)
+
+  #NaN where nothing was generated from any of base_labels, or none of them
+  #was reported
+  dominant=dependence.reindex(columns=base_labels, fill_value=0.0).idxmax(axis=1).where(base>0)
+  return Metrics(value, dependence, per_capita, growth, dominant, geo)
+
+
+def tables_for_year(m, year):
+  #the four tables the app reads, in the layout of the csv files they replace
+  def long(frame, name, labels=None):
+    d=frame.xs(year, level="year")
+    if labels is not None:
+      d=d.reindex(columns=[l for l in labels if l in d.columns])
+    d=d.stack(dropna=False).rename(name).reset_index()
+    return d.rename(columns={d.columns[0]: "country"})
+
+  master_elec=long(m.value, "lastValue")
+  master_elec["kWh PP"]=long(m.per_capita, "kWh PP")["kWh PP"].values
+  master_elec=master_elec.merge(m.geo[["lat", "long", "iso"]], how="left", left_on="country", right_index=True)
+
+  df_dep=long(m.dependence, "dependence")
+  df_dep.insert(2, "level", df_dep["label"].map(label_levels).astype(float))
+
+  dominant=m.dominant.xs(year, level="year").dropna()
+  df_dom=pd.DataFrame({
+    "iso": m.geo["iso"].reindex(dominant.index).values,
+    "country": dominant.index.values,
+    "dominant_source": dominant.values,
+    "score": dominant.map(source_scores).values,
+  })
+
+  df_growth=long(m.growth, "growth", ren)
+
+  return {"master_elec": master_elec, "df_dep": df_dep, "df_dom": df_dom, "df_growth": df_growth}
+
+
+#metrics that only feed rankings and rounded figures, held as float32 in a
+#compact cube
+compact_metrics=["kWh PP", "dependence", "growth"]
+
+class MetricsCube:
+  #the metrics as dense (year x country x label) arrays, so that any
+  #year/label/metric query is an array slice. rows missing from the series
+  #are NaN and have present[year, country] False
+  def __init__(self, m, compact=False):
+    self.years=np.array(m.years)
+    self.countries=np.array(sorted(m.value.index.get_level_values("country").unique()), dtype=object)
+    self.labels=list(m.value.columns)
+    self.year_index={y: i for i, y in enumerate(self.years)}
+    self.label_index={l: i for i, l in enumerate(self.labels)}
+    self.geo=m.geo.reindex(self.countries)
+
+    full=pd.MultiIndex.from_product([self.countries, self.years])
+    shape=(len(self.countries), len(self.years), len(self.labels))
+    def dense(frame):
+      return frame.reindex(index=full, columns=self.labels).values.reshape(shape).transpose(1, 0, 2).copy()
+    self.arrays={
+      "lastValue": dense(m.value),
+      "kWh PP": dense(m.per_capita),
+      "dependence": dense(m.dependence),
+      "growth": dense(m.growth),
+    }
+    if compact:
+      for metric in compact_metrics:
+        self.arrays[metric]=self.arrays[metric].astype(np.float32)
+    self.present=pd.Series(True, index=m.value.index).reindex(full, fill_value=False).values.reshape(shape[:2]).T.copy()
+    #index into base_labels, -1 where missing
+    codes=m.dominant.map({l: i for i, l in enumerate(base_labels)}).reindex(full).fillna(-1)
+    self.dominant=codes.values.astype(np.int8).reshape(shape[:2]).T.copy()
+
+  def columns(self, year):
+    #the four tables of one year as arrays, in the layout tables_for_year
+    #gives them (rows by country, then label), taken straight from the cube
+    y=self.year_index[year]
+    present=self.present[y]
+    countries=self.countries[present]
+    n, k=len(countries), len(self.labels)
+    rows={"country": np.repeat(countries, k), "label": np.tile(np.array(self.labels, dtype=object), n)}
+    geo=self.geo[present]
+    master_elec=dict(rows,
+      lastValue=self.arrays["lastValue"][y][present].ravel(),
+      **{"kWh PP": self.arrays["kWh PP"][y][present].ravel().astype(float)},
+      lat=np.repeat(geo["lat"].values, k),
+      long=np.repeat(geo["long"].values, k),
+      iso=np.repeat(geo["iso"].values, k))
+    df_dep=dict(rows, dependence=self.arrays["dependence"][y][present].ravel().astype(float))
+    code=self.dominant[y][present]
+    known=code>=0
+    df_dom={
+      "iso": geo["iso"].values[known],
+      "country": countries[known],
+      "dominant_source": np.array(base_labels, dtype=object)[code[known]],
+      "score": np.array([source_scores[l] for l in base_labels])[code[known]],
+    }
+    growth_labels=[l for l in ren if l in self.label_index]
+    df_growth={
+      "country": np.repeat(countries, len(growth_labels)),
+      "label": np.tile(np.array(growth_labels, dtype=object), n),
+      "growth": self.arrays["growth"][y][present][:, [self.label_index[l] for l in growth_labels]].ravel().astype(float),
+    }
+    return {"master_elec": master_elec, "df_dep": df_dep, "df_dom": df_dom, "df_growth": df_growth}
@@ -0,0 +1,97 @@
+import numpy as np
+
+
+#the table and column each ranked metric is read from
+metric_columns={
+  "lastValue": ("master_elec", "lastValue"),
+  "kWh PP": ("master_elec", "kWh PP"),
+  "dependence": ("df_dep", "dependence"),
+  "growth": ("df_growth", "growth"),
+}
+
+
+def _positions(*keys):
+  #row positions of each key in table order, and the row drop_duplicates
+  #would keep for it (the first)
+  groups={}
+  for i, key in enumerate(zip(*keys) if len(keys)>1 else keys[0]):
+    groups.setdefault(key, []).append(i)
+  return {k: np.array(v) for k, v in groups.items()}, {k: v[0] for k, v in groups.items()}
+
+
+class _Table:
+  #one table as column arrays, with its rows indexed by label and by
+  #(country, label), or by country for the tables without labels
+  def __init__(self, columns):
+    self.columns={name: np.asarray(values) for name, values in columns.items()}
+    self.by_country, first=_positions(self.columns["country"])
+    if "label" in self.columns:
+      self.by_label, _=_positions(self.columns["label"])
+      _, self.first=_positions(self.columns["country"], self.columns["label"])
+    else:
+      self.by_label=None
+      self.first=first
+
+  def get(self, key, column):
+    row=self.first.get(key)
+    return None if row is None else self.columns[column][row]
+
+
+#indexed access to the four tables the app reads (master_elec, df_dep,
+#df_dom and df_growth). every point lookup is a dict lookup instead of a
+#scan of the table, and a label's rows come out in table order, so results
+#(and ties) are the same as filtering the tables. built from the data frames
+#with from_frames, or straight from arrays (see MetricsCube.columns)
+class ElecTables:
+  def __init__(self, tables):
+    self.tables={name: _Table(columns) for name, columns in tables.items()}
+    self.countries=sorted(self.tables["master_elec"].by_country)
+
+  @classmethod
+  def from_frames(cls, tables):
+    return cls({name: {c: df[c].values for c in df.columns} for name, df in tables.items()})
+
+  #POINT LOOKUPS
+  #None where the table has no such row
+
+  def value(self, country, label):
+    #billion kWh
+    return self.tables["master_elec"].get((country, label), "lastValue")
+
+  def dependence(self, country, label):
+    #fraction of the power base
+    return self.tables["df_dep"].get((country, label), "dependence")
+
+  def dominant(self, country):
+    #one of "Fossil fuels", "Nuclear", "Renewable"
+    return self.tables["df_dom"].get(country, "dominant_source")
+
+  #COLUMNS
+
+  def label_column(self, label, metric, column=None):
+    #a column (default: the metric) over the rows of one label, in table
+    #order; empty if the label has no rows
+    table, name=metric_columns[metric]
+    t=self.tables[table]
+    rows=t.by_label.get(label, np.array([], dtype=int))
+    return t.columns[column or name][rows]
+
+  def ranked_labels(self, country, metric, labels, dropna=False):
+    #the country's labels among `labels`, ascending by the metric with NaN
+    #last (or left out, with dropna), ties in table order (a stable sort of
+    #the table)
+    table, name=metric_columns[metric]
+    t=self.tables[table]
+    values=t.columns[name]
+    rows=[r for r in t.by_country.get(country, []) if t.columns["label"][r] in labels]
+    if dropna:
+      rows=[r for r in rows if float(values[r])==float(values[r])]
+    def key(r):
+      v=float(values[r])
+      return (v!=v, 0.0 if v!=v else v)
+    rows.sort(key=key)
+    return [t.columns["label"][r] for r in rows]
+
+  def dominant_rows(self):
+    #df_dom as arrays: iso, country, dominant_source and score per row
+    return self.tables["df_dom"].columns
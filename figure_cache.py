@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+def data_version(paths):
+  #content hash of the data files, used to invalidate shared cache entries
+  h=hashlib.sha256()
+  for path in sorted(paths):
+    h.update(os.path.basename(path).encode())
+    with open(path, "rb") as f:
+      for chunk in iter(lambda: f.read(1 << 20), b""):
+        h.update(chunk)
+  return h.hexdigest()[:16]
+
+
+#file-backed store shared by every worker on the host. sqlite handles the
+#locking between processes; each process and thread opens its own connection.
+#cache keys are (data version, chart, key); the version gets its own column
+#and is part of the primary key, so workers on different data versions
+#(during a refresh) keep their own rows
+class SqliteFigureStore:
+  def __init__(self, path, version):
+    self.path=path
+    self._local=threading.local()
+    conn=self._conn()
+    #files written before the version joined the primary key are dropped
+    pk=[row[1] for row in sorted(conn.execute("PRAGMA table_info(figures)"), key=lambda row: row[5]) if row[5]]
+    if pk and pk!=["key", "version"]:
+      conn.execute("DROP TABLE figures")
+    conn.execute("CREATE TABLE IF NOT EXISTS figures (key TEXT NOT NULL, version TEXT NOT NULL, payload TEXT NOT NULL, PRIMARY KEY (key, version))")
+    conn.execute("DELETE FROM figures WHERE version != ?", (version,))
+    conn.commit()
+
+  def _conn(self):
+    #connections must not cross a fork, so they are keyed on the pid as well
+    conn=getattr(self._local, "conn", None)
+    if conn is None or self._local.pid!=os.getpid():
+      conn=sqlite3.connect(self.path, timeout=30)
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("PRAGMA synchronous=NORMAL")
+      self._local.conn=conn
+      self._local.pid=os.getpid()
+    return conn
+
+  def get(self, key):
+    row=self._conn().execute("SELECT payload FROM figures WHERE key = ? AND version = ?", (json.dumps(key[1:]), key[0])).fetchone()
+    return row[0] if row else None
+
+  def put(self, key, payload):
+    conn=self._conn()
+    conn.execute("INSERT OR REPLACE INTO figures (key, version, payload) VALUES (?, ?, ?)", (json.dumps(key[1:]), key[0], payload))
+    conn.commit()
+
+  def carry_over(self, old_version, new_version, is_stale):
+    #moves the rows still valid under new_version across and drops the rest.
+    #other workers may already have done this, which leaves nothing to move
+    conn=self._conn()
+    keys=[k for (k,) in conn.execute("SELECT key FROM figures WHERE version = ?", (old_version,))]
+    stale=[k for k in keys if is_stale(tuple(json.loads(k)))]
+    conn.executemany("DELETE FROM figures WHERE key = ? AND version = ?", [(k, old_version) for k in stale])
+    #rows a worker already rendered from the new data are kept over the old
+    conn.execute("DELETE FROM figures WHERE version = ? AND key IN (SELECT key FROM figures WHERE version = ?)", (old_version, new_version))
+    conn.execute("UPDATE figures SET version = ? WHERE version = ?", (new_version, old_version))
+    conn.commit()
+
+
+#figures only change with the data, so their serialized JSON is kept per
+#(data version, chart, key) and the least recently used entries are evicted.
+#an optional shared store sits behind the in-memory entries. get() adds its
+#build and serialize seconds, and whether it was a hit, to timings if given
+#(see callback_metrics.new_timings). with compress, the in-memory entries
+#are kept zlib-compressed
+class FigureCache:
+  def __init__(self, maxsize, store=None, compress=False):
+    self.maxsize=maxsize
+    self.store=store
+    self.compress=compress
+    self.bytes=0
+    self.hits=0
+    self.shared_hits=0
+    self.misses=0
+    self._data=OrderedDict()
+    self._lock=threading.Lock()
+
+  def get(self, key, build, timings=None):
+    status="hit"
+    with self._lock:
+      payload=self._data.get(key)
+      if payload is not None:
+        self._data.move_to_end(key)
+        self.hits+=1
+    if payload is not None and self.compress:
+      payload=zlib.decompress(payload).decode()
+    if payload is None:
+      payload=self.store.get(key) if self.store else None
+      if payload is not None:
+        status="shared"
+      else:
+        status="miss"
+        begin=time.perf_counter()
+        fig=build()
+        built=time.perf_counter()
+        payload=fig.to_json()
+        if timings is not None:
+          timings["build"]+=built-begin
+          timings["serialize"]+=time.perf_counter()-built
+        if self.store:
+          self.store.put(key, payload)
+      entry=zlib.compress(payload.encode(), 1) if self.compress else payload
+      with self._lock:
+        if status=="shared":
+          self.shared_hits+=1
+        else:
+          self.misses+=1
+        if key in self._data:
+          self.bytes-=len(self._data[key])
+        self._data[key]=entry
+        self.bytes+=len(entry)
+        while len(self._data)>self.maxsize:
+          self.bytes-=len(self._data.popitem(last=False)[1])
+    begin=time.perf_counter()
+    fig=json.loads(payload)
+    if timings is not None:
+      timings["serialize"]+=time.perf_counter()-begin
+      timings["cache"].add(status)
+    return fig
+
+  def carry_over(self, old_version, new_version, is_stale):
+    #after a data refresh: re-files the entries of old_version that are still
+    #valid under new_version and drops everything else
+    with self._lock:
+      data=OrderedDict()
+      for key, payload in self._data.items():
+        if key[0]==old_version and not is_stale(key[1:]):
+          data[(new_version,)+key[1:]]=payload
+      self._data=data
+      self.bytes=sum(len(payload) for payload in data.values())
+    if self.store:
+      self.store.carry_over(old_version, new_version, is_stale)
+
+  def stats(self):
+    with self._lock:
+      return {
+        "size": len(self._data),
+        "maxsize": self.maxsize,
+        "bytes": self.bytes,
+        "hits": self.hits,
+        "shared_hits": self.shared_hits,
+        "misses": self.misses,
+        "store": self.store.path if self.store else None,
+      }
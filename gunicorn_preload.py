@@ -0,0 +1,49 @@
+#gunicorn settings that load the app and its data once, in the master
+#process, and fork the workers from it. the workers share the master's pages
+#copy-on-write instead of each parsing the data again:
+#
+#    gunicorn -c gunicorn_preload.py app1:server
+#
+#the Procfile still starts plain `gunicorn app1:server`; use the line above
+#there to serve this way. workers and bind come from the command line or
+#WEB_CONCURRENCY and PORT as usual. with WARM_FIGURE_CACHE set the figure
+#cache is filled in the master too, and shared like the data. see
+#benchmarks/workers.py for the memory it saves
+import gc
+import os
+
+
+preload_app=True
+
+
+def _memory():
+  import app1
+  m=app1.process_memory()
+  if m["pss"] is None:
+    return "rss {:.1f} MB".format(m["rss"]/2**20)
+  return "rss {:.1f} MB, pss {:.1f} MB, private {:.1f} MB".format(m["rss"]/2**20, m["pss"]/2**20, m["private"]/2**20)
+
+def when_ready(server):
+  #dash validates the layout on a process's first request, visiting every
+  #object of the figures in it. run once here, before the fork, the workers
+  #skip it instead of each copying those pages
+  import app1
+  app1.server.try_trigger_before_first_request_functions()
+  #the metrics cube of the other years is otherwise built by each worker on
+  #its first request for one
+  app1.app_data.cube
+  #garbage left from loading is freed now rather than copied into each
+  #worker by its first collection
+  gc.collect()
+  server.log.info("app loaded in master %s: %s", os.getpid(), _memory())
+
+def pre_fork(server, worker):
+  #python's collector writes into every object it visits, which would copy
+  #the shared pages into each worker; what the master holds is moved out of
+  #its reach
+  gc.freeze()
+
+def post_worker_init(worker):
+  #right after the fork nearly all of a worker is shared; /memory-stats
+  #reports how that changes as it serves
+  worker.log.info("worker %s ready: %s", worker.pid, _memory())
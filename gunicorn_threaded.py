@@ -0,0 +1,17 @@
+#gunicorn settings for threaded workers, on top of gunicorn_preload.py. each
+#worker serves WORKER_THREADS requests at once (default 4), so the callbacks
+#one selection fires (the two trend charts and the country statements) are
+#built side by side, and a slow figure no longer holds up the requests
+#queued behind it:
+#
+#    gunicorn -c gunicorn_threaded.py app1:server
+#
+#the figure cache, year views and callback metrics are shared by the threads
+#of a worker and locked where they change
+import os
+
+from gunicorn_preload import *
+
+
+worker_class="gthread"
+threads=int(os.environ.get("WORKER_THREADS", 4))
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import elec_data
+from elec_data import load_artifact, read_manifest, write_artifact
+from test_elec_data import data
+
+
+def build(data, tmp_path):
+  path, manifest_path=str(tmp_path/"elec_data.bin"), str(tmp_path/"manifest.json")
+  write_artifact(data, path, manifest_path)
+  return path, read_manifest(manifest_path)
+
+
+def test_artifact_round_trip(data, tmp_path):
+  path, manifest=build(data, tmp_path)
+  assert manifest["version"]==data.version and elec_data.artifact_is_current(manifest)
+  #the missing iso is stored as an empty string plus a mask
+  assert "df_dom/iso/na" in manifest["arrays"] and "master_elec/country/na" not in manifest["arrays"]
+
+  loaded=load_artifact(manifest, path)
+  assert loaded.source=="artifact"
+  for name, df in data.tables.items():
+    pd.testing.assert_frame_equal(loaded.tables[name], df)
+  for attr in ["offsets", "dates", "values"]:
+    assert np.array_equal(getattr(loaded.series, attr), getattr(data.series, attr), equal_nan=True)
+  assert list(loaded.series.country)==list(data.series.country)
+  assert list(loaded.series.label)==list(data.series.label)
+  assert loaded.series.index==data.series.index
+
+def test_touched_source_is_current(data, tmp_path):
+  _, manifest=build(data, tmp_path)
+  #a checkout changes the mtime but not the content
+  st=os.stat(data.sources[0])
+  os.utime(data.sources[0], (st.st_atime, st.st_mtime+60))
+  assert elec_data.artifact_is_current(manifest)
+
+def test_changed_source_is_stale_with_another_missing(data, tmp_path):
+  _, manifest=build(data, tmp_path)
+  os.remove(data.sources[0])
+  assert elec_data.artifact_is_current(manifest)
+  with open(data.sources[1], "a") as f:
+    f.write("Kenya,Wind,4.0,0.01\n")
+  assert not elec_data.artifact_is_current(manifest)
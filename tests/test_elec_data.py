@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from elec_data import ElecData, build_series_store, classify_series, parse_catalog
+from figure_cache import data_version
+
+
+def series_frame():
+  #a small catalog in the layout of IntElecGen.json
+  def points(*values):
+    #one point a year from 1980, in ms
+    return [{"date": pd.Timestamp(1980+i, 1, 1).value//10**6, "value": v} for i, v in enumerate(values)]
+  return pd.DataFrame({
+    "name": [
+      "Electricity net generation, Kenya, Annual",
+      "Solar, tide, wave, fuel cell electricity net generation, Kenya, Annual",
+      "Solar electricity net generation, Kenya, Annual",
+      "Hydroelectricity net generation, Chile, Annual",
+      "Coal consumption, Chile, Annual",
+    ],
+    "units": "billion kWh",
+    "f": "A",
+    "data": [points(1.0, 2.0), points(0.1, "NA"), points(0.05, 0.07), points(20.0, "(s)"), points(5.0, 6.0)],
+  })
+
+def table_frames():
+  return {
+    "master_elec": pd.DataFrame({
+      "country": ["Kenya", "Kenya", "Chile"],
+      "label": ["Total Electricity net generation", "Solar", "Hydroelectricity"],
+      "lastValue": [2.0, 0.07, 20.0],
+      "kWh PP": [0.04, 0.001, 1.1],
+      "lat": [0.1, 0.1, -35.6],
+      "long": [37.9, 37.9, -71.5],
+      "iso": ["KEN", "KEN", np.nan],
+    }),
+    "df_dep": pd.DataFrame({"country": ["Kenya", "Chile"], "label": ["Solar", "Hydroelectricity"], "level": [4.0, 2.0], "dependence": [0.035, 0.9]}),
+    "df_dom": pd.DataFrame({"iso": ["KEN", np.nan], "country": ["Kenya", "Chile"], "dominant_source": ["Renewable", "Renewable"], "score": [-1, -1]}),
+    "df_growth": pd.DataFrame({"Unnamed: 0": [0, 1], "country": ["Kenya", "Chile"], "label": ["Solar", "Hydroelectricity"], "growth": [0.4, np.nan]}),
+  }
+
+@pytest.fixture
+def data(tmp_path, capsys):
+  sources=[]
+  for name, df in table_frames().items():
+    path=str(tmp_path/(name+".csv"))
+    df.to_csv(path, index=False)
+    sources.append(path)
+  series=build_series_store(classify_series(series_frame()))
+  capsys.readouterr()
+  return ElecData(table_frames(), series, data_version(sources), "raw", sources)
+
+
+def test_catalog_keeps_commas_in_categories():
+  parsed=parse_catalog([
+    "Solar, tide, wave, fuel cell electricity net generation, Kenya, Annual",
+    "Solar electricity net generation, Kenya, Annual",
+    "Electricity net generation, World, Annual",
+  ])
+  assert parsed["label"].tolist()==["Solar, tide, wave, fuel cell", "Solar", "Total Electricity net generation"]
+  assert parsed["country"].tolist()==["Kenya", "Kenya", "World"]
+
+def test_unmatched_series_are_dropped_and_reported(capsys):
+  df=classify_series(series_frame())
+  assert "Coal consumption, Chile, Annual" not in df["name"].values
+  assert list(zip(df["country"], df["label"]))==[
+    ("Kenya", "Total Electricity net generation"),
+    ("Kenya", "Solar, tide, wave, fuel cell"),
+    ("Kenya", "Solar"),
+    ("Chile", "Hydroelectricity"),
+  ]
+  err=capsys.readouterr().err
+  assert "1 series matched no category" in err and "Coal consumption, Chile, Annual" in err
+
+def test_sentinels_are_nan(data):
+  dates, values=data.series.get("Chile", "Hydroelectricity")
+  assert len(dates)==2 and values[0]==20.0 and np.isnan(values[1])
+
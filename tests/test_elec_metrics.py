@@ -0,0 +1,33 @@
+import numpy as np
+
+from elec_data import build_series_store, classify_series
+from elec_metrics import compute_metrics, geo_table, series_years
+from test_elec_data import series_frame, table_frames
+
+
+def metrics(capsys):
+  series=build_series_store(classify_series(series_frame()))
+  capsys.readouterr()
+  return series, compute_metrics(series, geo_table(table_frames()))
+
+
+def test_sentinels_stay_missing(capsys):
+  _, m=metrics(capsys)
+  #"NA" is missing, not zero; a label without points in a year is zero
+  assert np.isnan(m.value.loc[("Kenya", 1981), "Solar, tide, wave, fuel cell"])
+  assert m.value.loc[("Kenya", 1981), "Solar"]==0.07
+  assert m.value.loc[("Chile", 1980), "Solar"]==0.0
+  assert np.isnan(m.growth.loc[("Kenya", 1981)]).all()
+
+def test_sentinel_only_years_have_no_row(capsys):
+  series, m=metrics(capsys)
+  #Chile's only 1981 point is "(s)"
+  assert ("Chile", 1981) not in m.value.index
+  assert m.years==series_years(series)==[1980, 1981]
+
+def test_per_capita_only_in_the_population_year(capsys, monkeypatch):
+  monkeypatch.setattr("elec_metrics.population_year", 1980)
+  _, m=metrics(capsys)
+  #Kenya's population is implied by the table: 2.0 / 0.04
+  assert m.per_capita.loc[("Kenya", 1980), "Total Electricity net generation"]==1.0/50
+  assert np.isnan(m.per_capita.loc[("Kenya", 1981)]).all()
@@ -0,0 +1,98 @@
+import sqlite3
+
+import plotly.graph_objs as go
+
+from callback_metrics import new_timings
+from figure_cache import FigureCache, SqliteFigureStore
+
+
+def builder(calls, n=1):
+  def build():
+    calls.append(n)
+    return go.Figure(go.Bar(y=list(range(n))))
+  return build
+
+def rows(path):
+  with sqlite3.connect(path) as conn:
+    return sorted(conn.execute("SELECT key, version FROM figures"))
+
+
+def test_lru_eviction_and_bytes():
+  cache, calls=FigureCache(2), []
+  cache.get(("v1", "map", "a"), builder(calls))
+  cache.get(("v1", "map", "b"), builder(calls))
+  cache.get(("v1", "map", "a"), builder(calls))
+  #b is now the least recently used
+  cache.get(("v1", "map", "c"), builder(calls))
+  cache.get(("v1", "map", "a"), builder(calls))
+  cache.get(("v1", "map", "b"), builder(calls))
+  assert len(calls)==4
+  s=cache.stats()
+  assert (s["size"], s["hits"], s["misses"])==(2, 2, 4)
+  assert s["bytes"]==sum(len(p) for p in cache._data.values())
+
+def test_compressed_entries():
+  plain, compressed, calls=FigureCache(4), FigureCache(4, compress=True), []
+  key=("v1", "trend", "World")
+  fig=plain.get(key, builder(calls, 500))
+  assert compressed.get(key, builder(calls, 500))==fig
+  assert compressed.get(key, builder(calls, 500))==fig
+  assert len(calls)==2
+  assert compressed.stats()["bytes"]<plain.stats()["bytes"]
+
+def test_shared_store_hit(tmp_path):
+  path=str(tmp_path/"figures.db")
+  calls=[]
+  FigureCache(4, SqliteFigureStore(path, "v1")).get(("v1", "map", "a"), builder(calls))
+  other=FigureCache(4, SqliteFigureStore(path, "v1"))
+  timings=new_timings()
+  other.get(("v1", "map", "a"), builder(calls), timings)
+  assert len(calls)==1 and timings["cache"]=={"shared"}
+
+def test_store_versions_coexist(tmp_path):
+  path=str(tmp_path/"figures.db")
+  store=SqliteFigureStore(path, "v1")
+  store.put(("v1", "map", "a"), "old")
+  store.put(("v2", "map", "a"), "new")
+  assert store.get(("v1", "map", "a"))=="old"
+  assert store.get(("v2", "map", "a"))=="new"
+  #a worker starting on v2 purges the rest
+  SqliteFigureStore(path, "v2")
+  assert rows(path)==[('["map", "a"]', "v2")]
+
+def test_store_carry_over(tmp_path):
+  path=str(tmp_path/"figures.db")
+  store=SqliteFigureStore(path, "v1")
+  for k in ["stale", "kept", "redone"]:
+    store.put(("v1", "map", k), "old "+k)
+  #another worker already rendered this one from the new data
+  store.put(("v2", "map", "redone"), "new redone")
+  store.carry_over("v1", "v2", lambda key: key==("map", "stale"))
+  assert store.get(("v2", "map", "stale")) is None
+  assert store.get(("v2", "map", "kept"))=="old kept"
+  assert store.get(("v2", "map", "redone"))=="new redone"
+  assert [v for _, v in rows(path)]==["v2", "v2"]
+  #a second worker doing the same finds nothing left to move
+  store.carry_over("v1", "v2", lambda key: True)
+  assert len(rows(path))==2
+
+def test_cache_carry_over(tmp_path):
+  cache, calls=FigureCache(4, SqliteFigureStore(str(tmp_path/"figures.db"), "v1")), []
+  cache.get(("v1", "map", "a"), builder(calls))
+  cache.get(("v1", "trend", "Kenya"), builder(calls))
+  cache.carry_over("v1", "v2", lambda key: key[0]=="trend")
+  cache.get(("v2", "map", "a"), builder(calls))
+  cache.get(("v2", "trend", "Kenya"), builder(calls))
+  assert len(calls)==3
+  assert cache.stats()["bytes"]==sum(len(p) for p in cache._data.values())
+
+def test_old_schema_is_replaced(tmp_path):
+  path=str(tmp_path/"figures.db")
+  with sqlite3.connect(path) as conn:
+    conn.execute("CREATE TABLE figures (key TEXT PRIMARY KEY, version TEXT NOT NULL, payload TEXT NOT NULL)")
+    conn.execute("INSERT INTO figures VALUES ('[\"map\", \"a\"]', 'v1', 'old')")
+  store=SqliteFigureStore(path, "v1")
+  assert store.get(("v1", "map", "a")) is None
+  store.put(("v1", "map", "a"), "one")
+  store.put(("v2", "map", "a"), "two")
+  assert len(rows(path))==2
@@ -0,0 +1,19 @@
+import copy
+
+from elec_data import changed_countries
+from test_elec_data import data
+
+
+def test_changed_countries_none(data):
+  assert changed_countries(data, copy.deepcopy(data))==set()
+
+def test_changed_countries_series_edit(data):
+  new=copy.deepcopy(data)
+  start=new.series.offsets[new.series.index[("Kenya", "Solar")]]
+  new.series.values[start]=0.06
+  assert changed_countries(data, new)=={"Kenya"}
+
+def test_changed_countries_table_row_edit(data):
+  new=copy.deepcopy(data)
+  new.tables["df_dep"].loc[new.tables["df_dep"]["country"]=="Chile", "dependence"]=0.8
+  assert changed_countries(data, new)=={"Chile"}
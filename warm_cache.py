@@ -0,0 +1,97 @@
+#fills the shared figure store (FIGURE_CACHE_DB) with every figure the
+#dropdowns can request, rendered by a pool of processes, one per available
+#core by default. run it on deploy before starting gunicorn; the workers then
+#read each figure from the store instead of rendering it:
+#
+#    python warm_cache.py --db PATH [--processes N] [--years N] [--force]
+#
+#the data is loaded once and the pool is forked from it. figures already in
+#the store for the current data version are skipped unless --force is given
+import argparse
+import multiprocessing
+import os
+import time
+
+
+def available_cores():
+  try:
+    return len(os.sched_getaffinity(0))
+  except AttributeError:
+    return os.cpu_count() or 1
+
+
+def render(item):
+  #in a pool process: renders one figure into the store, unless it is there
+  #already. returns the chart and whether it was rendered
+  import app1
+  chart, key, force=item
+  k=(app1.app_data.version, chart, key)
+  if not force and app1.figure_store.get(k) is not None:
+    return chart, False
+  app1.figure_store.put(k, app1.figure_builders[chart](key).to_json())
+  return chart, True
+
+
+def warm(processes, years=None, force=False):
+  import app1
+  items=[(chart, key, force) for chart, key in app1.figure_keys(years)]
+  counts={}
+  for chart, _, _ in items:
+    counts.setdefault(chart, {"figures": 0, "rendered": 0})["figures"]+=1
+  begin=time.perf_counter()
+  #the year views, and the metrics cube they are read from, are built here
+  #too, rather than in every pool process. this is a one-off process, so
+  #COMPACT_MEMORY's limit on the views kept is lifted: a dropped view would
+  #be built again by each process that needs it
+  app1.max_year_views=None
+  for year in years or []:
+    app1.app_data.view(year)
+  #the first figure of each chart is rendered here, before the fork, so
+  #plotly's lazily imported validators are loaded once rather than in every
+  #pool process
+  charts=[chart for chart, _, _ in items]
+  first={charts.index(chart) for chart in counts}
+  results=[render(items[i]) for i in sorted(first)]
+  rest=[item for i, item in enumerate(items) if i not in first]
+  if processes>1:
+    methods=multiprocessing.get_all_start_methods()
+    context=multiprocessing.get_context("fork" if "fork" in methods else None)
+    with context.Pool(processes) as pool:
+      results+=pool.imap_unordered(render, rest, chunksize=4)
+  else:
+    results+=[render(item) for item in rest]
+  seconds=time.perf_counter()-begin
+  for chart, rendered in results:
+    counts[chart]["rendered"]+=rendered
+  rendered=sum(c["rendered"] for c in counts.values())
+  return {
+    "processes": processes,
+    "figures": len(items),
+    "rendered": rendered,
+    "seconds": seconds,
+    "rendered_per_second": rendered/seconds if seconds else 0.0,
+    "charts": counts,
+  }
+
+
+if __name__=="__main__":
+  parser=argparse.ArgumentParser(description="Render every figure into the shared figure store, in parallel.")
+  parser.add_argument("--db", default=os.environ.get("FIGURE_CACHE_DB"), help="the store's sqlite file (default: FIGURE_CACHE_DB)")
+  parser.add_argument("--processes", type=int, default=available_cores(), help="pool size (default: the available cores)")
+  parser.add_argument("--years", type=int, help="warm the N most recent years (default: the year the page opens on)")
+  parser.add_argument("--force", action="store_true", help="render figures already in the store again")
+  args=parser.parse_args()
+  if not args.db:
+    parser.error("no store: pass --db or set FIGURE_CACHE_DB")
+
+  #the app is imported against the store; warming at import would render
+  #everything in this process first
+  os.environ["FIGURE_CACHE_DB"]=args.db
+  os.environ.pop("WARM_FIGURE_CACHE", None)
+  import app1
+  years=app1.app_data.years[:args.years] if args.years else None
+  r=warm(args.processes, years, args.force)
+  for chart, c in r["charts"].items():
+    print("{:<16} {:>6} figures {:>6} rendered".format(chart, c["figures"], c["rendered"]))
+  print("{} of {} figures rendered in {:.2f}s by {} processes ({:.1f} figures/s) into {}".format(
+    r["rendered"], r["figures"], r["seconds"], r["processes"], r["rendered_per_second"], args.db))